@@ -54,6 +54,8 @@ export default function Room() {
 
   const [typingMap, setTypingMap] = useState<Record<string, boolean>>({});
   const [finished, setFinished] = useState(false);
+  // __lagged__ で取りこぼしたら増やして SSE を張り直す（履歴から全文を取り直す）
+  const [streamEpoch, setStreamEpoch] = useState(0);
 
   const humanRoles = useMemo<Role[]>(() => {
     if (sessionConfig) return sessionConfig.human_travelers;
@@ -134,6 +136,12 @@ export default function Room() {
           setTypingMap((m) => ({ ...m, [ev.who]: false }));
         } else if (ev.type === "typing") {
           setTypingMap((m) => ({ ...m, [ev.who]: ev.active }));
+        } else if (ev.type === "__lagged__") {
+          // 再接続するとサーバが履歴を先頭から送り直すので、いったん空にして取り直す
+          es.close();
+          sseRef.current = null;
+          setMsgs([]);
+          setStreamEpoch((n) => n + 1);
         }
       } catch {}
     };
@@ -147,7 +155,7 @@ export default function Room() {
       es.close();
       sseRef.current = null;
     };
-  }, [sessionId]);
+  }, [sessionId, streamEpoch]);
 
   // 自動スクロール
   useEffect(() => {
@@ -16,7 +16,13 @@ export type ChatMessage = {
 export type SSEMessageEvent = { type: "message"; who: string; content: string };
 export type SSETypingEvent = { type: "typing"; who: string; active: boolean };
 export type SSEEndEvent = { type: "__END__" };
-export type SSEEvent = SSEMessageEvent | SSETypingEvent | SSEEndEvent;
+// 受信が遅れてサーバ側で古いイベントが破棄された（dropped は読み飛ばした件数）。クライアントは再接続して履歴から取り直す
+export type SSELaggedEvent = { type: "__lagged__"; dropped: number };
+export type SSEEvent =
+  | SSEMessageEvent
+  | SSETypingEvent
+  | SSEEndEvent
+  | SSELaggedEvent;
 
 export type SessionConfig = {
   ai_travelers: Role[];
@@ -1,22 +1,37 @@
 import argparse
 import asyncio
 import csv
+import functools
 import json
+import re
+import hashlib
+import io
+import os
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, TypedDict, Literal, Any, Set
+from typing import Callable, TextIO, Dict, List, Optional, Tuple, TypedDict, Literal, Any, Set, TypeVar
 from datetime import datetime, timezone, timedelta
 import time
+import threading
+import traceback
 
 SatisfactionMultiSource = Literal["summary", "logs"]
+T = TypeVar("T")
 
 # ====== データ型 ======
 class WishesSplit(TypedDict, total=False):
-    public: List[str]
-    private: List[str]
+    public: Tuple[str, ...]
+    private: Tuple[str, ...]
 
-WishesDict = Dict[str, WishesSplit]  # 旅行者A/B/C/D -> {public:[], private:[]}
+WishesDict = Dict[str, WishesSplit]  # 旅行者A/B/C/D -> {public:(...), private:(...)}
 # MODEL_NAME = "gpt-5"
 MODEL_NAME = MODEL_NAME = "gpt-5-mini"
+# 日程・予算の抽出は単純な要約なので軽量モデルで十分（--extract-model で変更可）
+EXTRACT_MODEL = "gpt-4o-mini"
+# 抽出結果は短いので出力トークンに上限を設ける（3日分の日本語要約が切れない程度の余裕を持たせる）
+# 推論モデルでは上限に推論トークンも含まれ、本文が空のまま打ち切られるので上限を付けない
+DAYS_MAX_TOKENS = 1024
+BUDGET_MAX_TOKENS = 128
+REASONING_MODEL_PREFIXES = ("gpt-5", "o1", "o3", "o4")
 
 DEFAULT_WISHES_TEXT = """.;]:
 [旅行者A 公開]
@@ -90,34 +105,30 @@ DEFAULT_WISHES_TEXT = """.;]:
 """.strip()
 
 # ====== 希望の読み込み・整形 ======
-def _ensure_keys(d: WishesSplit) -> WishesSplit:
-    return {"public": d.get("public", []) or [], "private": d.get("private", []) or []}
+def _ensure_keys(d: Dict[str, Any]) -> WishesSplit:
+    # 読み込み時に tuple へ固定する（以降は不変なので format_wish_bullets で内容キャッシュが効く）
+    return {"public": tuple(d.get("public") or ()), "private": tuple(d.get("private") or ())}
+
+# 見出し [旅行者A 公開] と箇条書き "- ..." を1回の走査で拾う（前後の空白は無視）
+WISHES_LINE_RE = re.compile(r"^[^\S\n]*(?:\[(.*)\]|- (.*\S))[^\S\n]*$", re.M)
 
 def parse_wishes_text(txt: str) -> WishesDict:
-    data: WishesDict = {}
-    current: Optional[Tuple[str, str]] = None  # (traveler, section)
-    for raw in txt.splitlines():
-        line = raw.strip()
-        if not line:
-            continue
-        if line.startswith("[") and line.endswith("]"):
-            header = line[1:-1].strip()
+    data: Dict[str, Dict[str, List[str]]] = {}
+    bucket: Optional[List[str]] = None  # 現在の見出しの public/private リスト
+    for m in WISHES_LINE_RE.finditer(txt):
+        header, bullet = m.groups()
+        if header is not None:
+            header = header.strip()
             if " " in header:
                 traveler, section = header.split(None, 1)
             else:
                 traveler, section = header, "公開"
             if traveler not in data:
                 data[traveler] = {"public": [], "private": []}
-            current = (traveler, section)
-        elif line.startswith("- ") and current:
-            traveler, section = current
-            if section == "非公開":
-                data[traveler]["private"].append(line[2:])
-            else:
-                data[traveler]["public"].append(line[2:])
-    for k, v in list(data.items()):
-        data[k] = _ensure_keys(v)
-    return data
+            bucket = data[traveler]["private" if section == "非公開" else "public"]
+        elif bucket is not None:
+            bucket.append(bullet)
+    return {k: _ensure_keys(v) for k, v in data.items()}
 
 def load_wishes(path: Optional[str]) -> WishesDict:
     if not path:
@@ -130,159 +141,428 @@ def load_wishes(path: Optional[str]) -> WishesDict:
         data: WishesDict = {}
         for person, obj in js.items():
             if isinstance(obj, dict):
-                data[person] = _ensure_keys({
-                    "public": obj.get("public", []) or [],
-                    "private": obj.get("private", []) or [],
-                })
+                data[person] = _ensure_keys(obj)
             elif isinstance(obj, list):
                 data[person] = _ensure_keys({"public": obj, "private": []})
         return data
     return parse_wishes_text(p.read_text(encoding="utf-8"))
 
+def _memo_by_identity(fn: Callable[[Any], T]) -> Callable[[Any], T]:
+    """同じ wishes インスタンスを全試行で使い回すため、引数の同一性でメモ化する（参照も保持して id の再利用を防ぐ）。"""
+    cache: Dict[int, Tuple[Any, T]] = {}
+
+    @functools.wraps(fn)
+    def wrapper(obj: Any) -> T:
+        hit = cache.get(id(obj))
+        if hit is not None and hit[0] is obj:
+            return hit[1]
+        result = fn(obj)
+        cache[id(obj)] = (obj, result)
+        return result
+    return wrapper
+
+@functools.lru_cache(maxsize=None)
+def format_wish_bullets(bullets: Tuple[str, ...], sep: str, head: str = "", empty: str = "（なし）") -> str:
+    """希望の箇条書きを head + sep 区切りで連結する（空なら empty）。単発/マルチ/レポートで共通に使う。"""
+    return head + sep.join(bullets) if bullets else empty
+
+@_memo_by_identity
 def wishes_to_block_for_single(wishes: WishesDict) -> str:
     parts: List[str] = []
     for name, sp in wishes.items():
-        pub = "\n- ".join(sp["public"]) if sp["public"] else "（なし）"
-        prv = "\n- ".join(sp["private"]) if sp["private"] else "（なし）"
+        pub = format_wish_bullets(sp["public"], "\n- ")
+        prv = format_wish_bullets(sp["private"], "\n- ")
         block = f"[{name} 公開]\n- {pub}\n\n[{name} 非公開]\n- {prv}"
         parts.append(block)
     return "\n\n".join(parts)
 
+@_memo_by_identity
 def wishes_public_only_block(wishes: WishesDict) -> str:
     parts: List[str] = []
     for name, sp in wishes.items():
-        pub = "\n- ".join(sp["public"]) if sp["public"] else "（なし）"
+        pub = format_wish_bullets(sp["public"], "\n- ")
         parts.append(f"[{name} 公開]\n- {pub}")
     return "\n\n".join(parts)
 
-def build_agent_system(name_ja: str, public_bullets: List[str], private_bullets: List[str]) -> str:
-    pub = "".join(f"・{b}" for b in (public_bullets or []))
-    prv = "".join(f"・{b}" for b in (private_bullets or []))
+AGENT_POLICY = (
+    "【非譲歩ポリシー】"
+    "1) 譲歩幅は最小限（代替案の提示を優先し、自分の希望の放棄を避ける）。"
+    "2) あなたの非公開希望に反する提案は丁寧に拒否し別案を要求する。"
+    "3) 合意文を受け入れる前に、すべての希望が満たされているか厳密に自己確認する。"
+)
+
+def build_agent_system(name_ja: str, public_bullets: Tuple[str, ...], private_bullets: Tuple[str, ...]) -> str:
+    pub = format_wish_bullets(public_bullets, "・", "・", "")
+    prv = format_wish_bullets(private_bullets, "・", "・", "")
     return (
         f"あなたは交渉参加者の{name_ja}です。"
-        +"あなたの役割は、自分の公開希望と非公開希望を最大限に反映した合意に到達するため、交渉で一貫して自己主張することです。"
-        +"以下はあなたの『公開してもよい希望』です。"
-        +f"{pub}"
-        +"以下はあなたの『非公開の希望』です（内容を直接言及してはいけません。満たす/守る方向で交渉してください）。"
-        +f"{prv}"
-        +"【非譲歩ポリシー】"
-        +"1) 譲歩幅は最小限（代替案の提示を優先し、自分の希望の放棄を避ける）。"
-        +"2) あなたの非公開希望に反する提案は丁寧に拒否し別案を要求する。"
-        +"3) 合意文を受け入れる前に、すべての希望が満たされているか厳密に自己確認する。"
+        "あなたの役割は、自分の公開希望と非公開希望を最大限に反映した合意に到達するため、交渉で一貫して自己主張することです。"
+        "以下はあなたの『公開してもよい希望』です。"
+        f"{pub}"
+        "以下はあなたの『非公開の希望』です（内容を直接言及してはいけません。満たす/守る方向で交渉してください）。"
+        f"{prv}"
+        f"{AGENT_POLICY}"
     )
 
+# ====== プロンプト（試行間で不変。先頭の静的部分を揃えて OpenAI のプロンプトキャッシュを効かせる） ======
+SINGLE_FULL_SYSTEM = (
+    "あなたは旅行プランナー。\n"
+    "- 2泊3日の国内旅行案を、4名の希望の交差を最大化する形で一本化する\n"
+    "- 出力は自然言語のみ（文章形式）\n"
+    "- 最終的に 行き先、予算、宿泊のスタイル、主なアクティビティ、簡単な日程 をまとめる\n"
+    "- 日ごと（1/2/3日目）で書く\n"
+)
+
+SINGLE_PUBLIC_SYSTEM = (
+    "あなたは旅行プランナー。\n"
+    "- 2泊3日の国内旅行案を、4名の希望の交差を最大化する形で一本化\n"
+    "- 出力は自然言語のみ。1〜3日目と要点（行き先/予算/宿/主アクティビティ）を含める\n"
+)
+
+MODERATOR_SYSTEM = (
+    "あなたは旅行計画会議の司会者です。"
+    "旅行者A-Dの議論を円滑に進め、全員の意見を公平に引き出してください。"
+    "あなた自身は意見を述べず、発言の順番を管理し、要点を簡潔に整理することに集中します。"
+    "他の参加者の代弁や代理発言をしてはいけません。"
+    "交渉では表・図・PDF・CSV・数値資料などの外部ファイルは使用せず、自然言語のやりとりのみを扱います。"
+    "ルールや方針の説明は不要です。"
+    "全員が明確に『賛成』『同意』『了承』などと表明した場合のみ、"
+    "その直後のターンで次の語を単独で出力してください：『【合意確定】』。"
+    "それ以外のタイミングではこの語を絶対に出力してはいけません。"
+)
+
+DAYS_SYSTEM = (
+    "あなたはテキスト要約者です。与えられた旅行計画テキストから、"
+    "1日目/2日目/3日目の内容を日本語で簡潔に要約し、JSONで返してください。"
+    "厳守: JSONのみを出力し、キーは day1/day2/day3。不明は空文字。"
+    "出力例: {\"day1\":\"...\",\"day2\":\"...\",\"day3\":\"...\"}"
+)
+
+BUDGET_SYSTEM = (
+    "あなたはテキスト要約者です。与えられた旅行計画テキストから、"
+    "最終合意された予算（例: 3万円以内, 3〜5万円, 5万円程度 など）を1文で抽出し、JSONで返してください。"
+    "厳守: JSONのみを出力し、キーは budget。不明は空文字。"
+    "出力例: {\"budget\":\"3万円以内\"}"
+)
+
+PLAN_FROM_MULTI_SYSTEM = (
+    "あなたは議事録要約者です。以下の交渉ログから、"
+    "『行き先』『予算』『宿泊のスタイル』『主なアクティビティ』『1〜3日目の簡易行程』を中心に"
+    "できるだけ詳細に計画文としてまとめてください。"
+    "不明点は『不明』と書いて構いません。"
+)
+
+SCORE_SYSTEM = (
+    "あなたは要件充足性の審査官です。"
+    "入力の『計画文』と『希望（公開/非公開）』を比較し、各希望が満たされるかを判定してください。"
+    "厳守: 出力はJSONのみ。persons に人ごとの name（入力の人名キー）と public/private を置き、"
+    "各々 items=[{wish, ok, reason}] とし、total と satisfied を数値で含める。"
+    "ok は true/false のみ。曖昧なら false として良い。"
+    "出力例: {\"persons\": [{\"name\": \"旅行者A\", "
+    "\"public\": {\"total\": 2, \"satisfied\": 1, \"items\": ["
+    "{\"wish\": \"混雑を避けたい\", \"ok\": true, \"reason\": \"閑散期の平日観光を提案\"}, "
+    "{\"wish\": \"カヌー体験\", \"ok\": false, \"reason\": \"計画文に明記なし\"}]}, "
+    "\"private\": {\"total\": 1, \"satisfied\": 1, \"items\": ["
+    "{\"wish\": \"予算5万円以内\", \"ok\": true, \"reason\": \"総額4.8万円と記載\"}]}}]}\n"
+    "※上記は形式例。実際の数・内容は入力に合わせて評価すること。"
+)
+
+# Structured Outputs（strict）用スキーマ。strict では任意キーの object を書けないため、人ごとの判定は persons 配列で受ける
+_SCORE_SECTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "total": {"type": "integer"},
+        "satisfied": {"type": "integer"},
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "wish": {"type": "string"},
+                    "ok": {"type": "boolean"},
+                    "reason": {"type": "string"},
+                },
+                "required": ["wish", "ok", "reason"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["total", "satisfied", "items"],
+    "additionalProperties": False,
+}
+
+SCORE_RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "wish_scoring",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "persons": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string"},
+                            "public": _SCORE_SECTION_SCHEMA,
+                            "private": _SCORE_SECTION_SCHEMA,
+                        },
+                        "required": ["name", "public", "private"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["persons"],
+            "additionalProperties": False,
+        },
+    },
+}
+
 # ====== OpenAI ヘルパ ======
+JST = timezone(timedelta(hours=9), "JST")
+
 def jst_now_iso() -> str:
-    jst = timezone(timedelta(hours=9))
-    return datetime.now(jst).strftime("%Y-%m-%d %H:%M:%S %Z")
+    return datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S JST")
+
+# クライアントはプロセスで1つだけ作って使い回す（呼び出しごとの TCP/TLS ハンドシェイクを避ける）
+OPENAI_MAX_CONNECTIONS = 64
 
+@functools.lru_cache(maxsize=1)
 def _client():
     from openai import OpenAI
     return OpenAI()
 
-def llm_extract_days(title: str, text: str) -> List[str]:
-    print ("llm_extract_days発火")
-    client = _client()
-    sys = (
-        "あなたはテキスト要約者です。与えられた旅行計画テキストから、"
-        "1日目/2日目/3日目の内容を日本語で簡潔に要約し、JSONで返してください。"
-        "厳守: JSONのみを出力し、キーは day1/day2/day3。不明は空文字。"
+@functools.lru_cache(maxsize=1)
+def _aclient():
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    return AsyncOpenAI(
+        http_client=DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+        ),
     )
-    user = f"タイトル: {title}\n\n本文:\n{text}\n\n出力例: {{\"day1\":\"...\",\"day2\":\"...\",\"day3\":\"...\"}}"
+
+async def aclose_clients() -> None:
+    """共有クライアントを閉じる（main の終了時に1回）。"""
+    if _aclient.cache_info().currsize:
+        await _aclient().close()
+        _aclient.cache_clear()
+    if _client.cache_info().currsize:
+        _client().close()
+        _client.cache_clear()
+
+# --- プロンプトキャッシュのヒット状況（usage.prompt_tokens_details.cached_tokens を集計） ---
+_usage_lock = threading.Lock()
+_usage_totals = {"prompt_tokens": 0, "cached_tokens": 0}
+
+def _record_usage(usage: Any) -> None:
+    """chat.completions の usage（SDKオブジェクト or Batch 結果の dict）を加算する。"""
+    if not usage:
+        return
+    if isinstance(usage, dict):
+        prompt = usage.get("prompt_tokens") or 0
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    else:
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+    with _usage_lock:
+        _usage_totals["prompt_tokens"] += prompt
+        _usage_totals["cached_tokens"] += cached
+
+def prompt_cache_summary() -> str:
+    with _usage_lock:
+        prompt, cached = _usage_totals["prompt_tokens"], _usage_totals["cached_tokens"]
+    return f"[CACHE] cached prompt tokens: {cached}/{prompt} ({_pct(cached, prompt)})"
+
+# --- リクエスト組み立て／応答パース（同期呼び出しと Batch API で共用） ---
+def _extract_limit(max_tokens: int) -> Dict[str, Any]:
+    """抽出用の出力上限。推論モデル（--extract-model gpt-5 など）では付けない。"""
+    if EXTRACT_MODEL.startswith(REASONING_MODEL_PREFIXES):
+        return {}
+    return {"max_completion_tokens": max_tokens}
+
+def _days_request(title: str, text: str) -> Dict[str, Any]:
+    user = f"タイトル: {title}\n\n本文:\n{text}"
+    return {
+        "model": EXTRACT_MODEL,
+        "messages": [{"role": "system", "content": DAYS_SYSTEM},
+                     {"role": "user", "content": user}],
+        "response_format": {"type": "json_object"},
+        **_extract_limit(DAYS_MAX_TOKENS),
+    }
+
+def _parse_days(content: str) -> List[str]:
+    js = json.loads(content)
+    return [js.get("day1", "") or "", js.get("day2", "") or "", js.get("day3", "") or ""]
+
+def _budget_request(title: str, text: str) -> Dict[str, Any]:
+    user = f"タイトル: {title}\n\n本文:\n{text}"
+    return {
+        "model": EXTRACT_MODEL,
+        "messages": [{"role": "system", "content": BUDGET_SYSTEM},
+                     {"role": "user", "content": user}],
+        "response_format": {"type": "json_object"},
+        **_extract_limit(BUDGET_MAX_TOKENS),
+    }
+
+def _parse_budget(content: str) -> str:
+    return (json.loads(content).get("budget", "") or "").strip()
+
+def format_multi_logs(multi_logs: List[Tuple[str, str]]) -> str:
+    """マルチ交渉ログを LLM 入力用の1本のテキストにする（試行ごとに1回だけ作って使い回す）。"""
+    return "\n".join(f"[{s}] {c}" for s, c in multi_logs) if multi_logs else ""
+
+def _plan_from_multi_request(full: str) -> Dict[str, Any]:
+    return {
+        "model": "gpt-4o-2024-08-06",
+        "messages": [{"role": "system", "content": PLAN_FROM_MULTI_SYSTEM},
+                     {"role": "user", "content": full}],
+    }
+
+def _parse_plan(content: str) -> str:
+    return content.strip()
+
+# --- 応答キャッシュ（リクエスト本文の完全一致。model/system/user/パラメータをすべてキーに含む） ---
+LLM_CACHE_DIR: Optional[Path] = Path(".cache/llm")
+
+async def _cached_achat(body: Dict[str, Any], parse: Callable[[str], T]) -> T:
+    """body で chat.completions を呼び、parse した結果を返す。
+    LLM_CACHE_DIR があれば sha256(body) をキーに応答本文をディスクへ保存し、同一リクエストは再利用する。
+    parse に失敗した応答と、出力上限で打ち切られた応答（finish_reason="length"）はキャッシュしない。"""
+    path: Optional[Path] = None
+    if LLM_CACHE_DIR is not None:
+        key = hashlib.sha256(json.dumps(body, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        path = LLM_CACHE_DIR / f"{key}.json"
+        if path.exists():
+            try:
+                return parse(json.loads(path.read_text(encoding="utf-8"))["content"])
+            except Exception:
+                pass
+
+    resp = await _aclient().chat.completions.create(**body)
+    _record_usage(resp.usage)
+    choice = resp.choices[0]
+    if choice.finish_reason == "length":
+        raise ValueError(f"response truncated by output token limit (model={body['model']})")
+    content = choice.message.content
+    result = parse(content)
+
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"content": content}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+    return result
+
+async def llm_extract_days(title: str, text: str) -> List[str]:
+    print ("llm_extract_days発火")
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-2024-08-06",
-            messages=[{"role": "system", "content": sys},
-                      {"role": "user", "content": user}],
-            response_format={"type": "json_object"},
-        )
-        js = json.loads(resp.choices[0].message.content)
-        return [js.get("day1", "") or "", js.get("day2", "") or "", js.get("day3", "") or ""]
-    except Exception:
+        return await _cached_achat(_days_request(title, text), _parse_days)
+    except Exception as e:
+        print(f"[WARN] llm_extract_days failed: {e!r}")
         return ["", "", ""]
 
-def llm_extract_budget(title: str, text: str) -> str:
+async def llm_extract_budget(title: str, text: str) -> str:
     print ("llm_extract_budget発火")
-    client = _client()
-    sys = (
-        "あなたはテキスト要約者です。与えられた旅行計画テキストから、"
-        "最終合意された予算（例: 3万円以内, 3〜5万円, 5万円程度 など）を1文で抽出してください。"
-        "不明なら空文字。"
-    )
-    user = f"タイトル: {title}\n\n本文:\n{text}"
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-2024-08-06",
-            messages=[{"role": "system", "content": sys},
-                      {"role": "user", "content": user}],
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception:
+        return await _cached_achat(_budget_request(title, text), _parse_budget)
+    except Exception as e:
+        print(f"[WARN] llm_extract_budget failed: {e!r}")
         return ""
 
-def llm_extract_plan_from_multi(multi_logs: List[Tuple[str, str]]) -> str:
+async def llm_extract_plan_from_multi(multi_logs: List[Tuple[str, str]], multi_full: Optional[str] = None) -> str:
     print ("llm_extract_plan_from_multi発火")
-    client = _client()
-    full = "\n".join(f"[{s}] {c}" for s, c in multi_logs)
-    sys = (
-        "あなたは議事録要約者です。以下の交渉ログから、"
-        "『行き先』『予算』『宿泊のスタイル』『主なアクティビティ』『1〜3日目の簡易行程』を中心に"
-        "できるだけ詳細に計画文としてまとめてください。"
-        "不明点は『不明』と書いて構いません。"
-    )
+    if multi_full is None:
+        multi_full = format_multi_logs(multi_logs)
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-2024-08-06",
-            messages=[{"role": "system", "content": sys},
-                      {"role": "user", "content": full}],
-        )
-        return resp.choices[0].message.content.strip()
+        resp = await _aclient().chat.completions.create(**_plan_from_multi_request(multi_full))
+        _record_usage(resp.usage)
+        return _parse_plan(resp.choices[0].message.content)
     except Exception:
         return ""
 
-# ====== Single（全公開=公開+非公開） ======
-def run_single(wishes: WishesDict) -> Tuple[str, float]:
+# ====== Batch API（評価フェーズの一括実行） ======
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def run_batch(bodies: Dict[str, Dict[str, Any]], poll_sec: float = 30.0) -> Dict[str, str]:
+    """custom_id -> chat.completions リクエスト本文 を Batch API で一括実行し、custom_id -> 応答本文 を返す。
+    失敗したリクエストは返却に含めない（呼び出し側で同期版と同じフォールバックを適用する）。"""
+    if not bodies:
+        return {}
     client = _client()
-    system = (
-        "あなたは旅行プランナー。\n"
-        "- 2泊3日の国内旅行案を、4名の希望の交差を最大化する形で一本化する\n"
-        "- 出力は自然言語のみ（文章形式）\n"
-        "- 最終的に 行き先、予算、宿泊のスタイル、主なアクティビティ、簡単な日程 をまとめる\n"
-        "- 日ごと（1/2/3日目）で書く\n"
+    lines = [
+        json.dumps({"custom_id": cid, "method": "POST", "url": "/v1/chat/completions", "body": body}, ensure_ascii=False)
+        for cid, body in bodies.items()
+    ]
+    input_file = client.files.create(
+        file=("batch_input.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
     )
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"[BATCH] submitted {batch.id} ({len(bodies)} requests)")
+    while batch.status not in BATCH_TERMINAL_STATUSES:
+        time.sleep(poll_sec)
+        batch = client.batches.retrieve(batch.id)
+    print(f"[BATCH] {batch.id} -> {batch.status}")
+
+    out: Dict[str, str] = {}
+    if not batch.output_file_id:
+        return out
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        resp = rec.get("response") or {}
+        if resp.get("status_code") != 200:
+            continue
+        _record_usage((resp.get("body") or {}).get("usage"))
+        try:
+            choice = resp["body"]["choices"][0]
+            if choice.get("finish_reason") == "length":
+                print(f"[WARN] batch: {rec['custom_id']} truncated by output token limit")
+                continue
+            out[rec["custom_id"]] = choice["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            continue
+    return out
+
+# ====== Single（全公開=公開+非公開） ======
+async def run_single(wishes: WishesDict) -> Tuple[str, float]:
     prompt = "次の4名の希望（公開/非公開）を統合して最終合意案を1本化:\n\n" + wishes_to_block_for_single(wishes)
     t0 = time.perf_counter()
-    resp = client.chat.completions.create(
+    resp = await _aclient().chat.completions.create(
         model=MODEL_NAME,
-        messages=[{"role": "system", "content": system},
+        messages=[{"role": "system", "content": SINGLE_FULL_SYSTEM},
                   {"role": "user", "content": prompt}],
     )
     t1 = time.perf_counter()
+    _record_usage(resp.usage)
     plan = resp.choices[0].message.content.strip()
     print("\n=== Single (全公開シングル) ===\n")
     print(plan)
     return plan, (t1 - t0)
 
 # ====== Single（半公開=公開のみで計画） ======
-def run_single_public_only(wishes: WishesDict) -> Tuple[str, float]:
-    client = _client()
-    system = (
-        "あなたは旅行プランナー。\n"
-        "- 2泊3日の国内旅行案を、4名の希望の交差を最大化する形で一本化\n"
-        "- 出力は自然言語のみ。1〜3日目と要点（行き先/予算/宿/主アクティビティ）を含める\n"
-    )
+async def run_single_public_only(wishes: WishesDict) -> Tuple[str, float]:
     # 非公開情報は渡さない
     prompt = "次の4名の希望を前提に、2泊3日の合意案を1本化:\n\n" + wishes_public_only_block(wishes)
 
     t0 = time.perf_counter()
-    resp = client.chat.completions.create(
+    resp = await _aclient().chat.completions.create(
         model=MODEL_NAME,
         messages=[
-            {"role": "system", "content": system},
+            {"role": "system", "content": SINGLE_PUBLIC_SYSTEM},
             {"role": "user", "content": prompt},
         ],
     )
     t1 = time.perf_counter()
+    _record_usage(resp.usage)
     plan = resp.choices[0].message.content.strip()
     print("\n=== Single (半公開シングル: 公開のみ) ===\n")
     print(plan)
@@ -298,16 +578,81 @@ class MultiResult:
         rounds: int = 0,
     ):
         self.messages = messages
+        self.full_text = format_multi_logs(messages)  # LLM 入力用（試行ごとに1回だけ構築）
         self.stop_reason = stop_reason
         self.duration_sec = duration_sec
         self.message_count = message_count
         self.rounds = rounds
 
-async def run_multi_async(wishes: WishesDict) -> MultiResult:
-    from autogen_agentchat.agents import AssistantAgent
-    from autogen_agentchat.conditions import TextMentionTermination, MaxMessageTermination
-    from autogen_agentchat.teams import RoundRobinGroupChat
-    from autogen_ext.models.openai import OpenAIChatCompletionClient
+def build_agent_systems(wishes: WishesDict) -> Dict[str, str]:
+    """旅行者A〜D の役割プロンプト（試行間で不変なので main で1回だけ作る）。"""
+    out: Dict[str, str] = {}
+    for name in ("旅行者A", "旅行者B", "旅行者C", "旅行者D"):
+        sp = wishes.get(name, {})
+        out[name] = build_agent_system(
+            name,
+            sp.get("public", ()),
+            sp.get("private", ()),
+        )
+    return out
+
+class MultiTeamPool:
+    """司会+旅行者A〜D のチームとモデルクライアントを試行間で使い回す。
+    同時に走る試行はそれぞれ別のチームを借り、返却時に team.reset() で会話状態を消す。"""
+
+    def __init__(self, agent_systems: Dict[str, str]):
+        self.agent_systems = agent_systems
+        self._idle: List[Any] = []
+        self._moderator_model_client: Any = None
+        self._agent_model_client: Any = None
+
+    def _build(self) -> Any:
+        from autogen_agentchat.agents import AssistantAgent
+        from autogen_agentchat.conditions import TextMentionTermination, MaxMessageTermination
+        from autogen_agentchat.teams import RoundRobinGroupChat
+        from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+        if self._moderator_model_client is None:
+            self._moderator_model_client = OpenAIChatCompletionClient(model=MODEL_NAME)
+            self._agent_model_client = OpenAIChatCompletionClient(model=MODEL_NAME)
+
+        moderator = AssistantAgent(
+            name="moderator",
+            system_message=MODERATOR_SYSTEM,
+            model_client=self._moderator_model_client,
+        )
+        agent_systems = self.agent_systems
+        agent_model_client = self._agent_model_client
+        agentA = AssistantAgent(name="traveler_A", system_message=agent_systems["旅行者A"], model_client=agent_model_client)
+        agentB = AssistantAgent(name="traveler_B", system_message=agent_systems["旅行者B"], model_client=agent_model_client)
+        agentC = AssistantAgent(name="traveler_C", system_message=agent_systems["旅行者C"], model_client=agent_model_client)
+        agentD = AssistantAgent(name="traveler_D", system_message=agent_systems["旅行者D"], model_client=agent_model_client)
+
+        termination = TextMentionTermination("【合意確定】") | MaxMessageTermination(50)
+        return RoundRobinGroupChat([moderator, agentA, agentB, agentC, agentD], termination_condition=termination)
+
+    def acquire(self) -> Any:
+        return self._idle.pop() if self._idle else self._build()
+
+    async def release(self, team: Any) -> None:
+        try:
+            await team.reset()
+        except Exception:
+            return  # 状態を消せなかったチームは捨てる
+        self._idle.append(team)
+
+    async def close(self) -> None:
+        self._idle.clear()
+        if self._moderator_model_client is not None:
+            await self._moderator_model_client.close()
+            await self._agent_model_client.close()
+            self._moderator_model_client = self._agent_model_client = None
+
+async def run_multi_async(
+    wishes: WishesDict,
+    agent_systems: Optional[Dict[str, str]] = None,
+    pool: Optional[MultiTeamPool] = None,
+) -> MultiResult:
     from autogen_agentchat.ui import Console
 
     DISPLAY_NAME = {
@@ -318,40 +663,10 @@ async def run_multi_async(wishes: WishesDict) -> MultiResult:
         "traveler_D": "旅行者D",
     }
 
-    moderator_model_client = OpenAIChatCompletionClient(model=MODEL_NAME)
-    agent_model_client = OpenAIChatCompletionClient(model=MODEL_NAME)
-
-    moderator = AssistantAgent(
-        name="moderator",
-        system_message=(
-            "あなたは旅行計画会議の司会者です。"
-            "旅行者A-Dの議論を円滑に進め、全員の意見を公平に引き出してください。"
-            "あなた自身は意見を述べず、発言の順番を管理し、要点を簡潔に整理することに集中します。"
-            "他の参加者の代弁や代理発言をしてはいけません。"
-            "交渉では表・図・PDF・CSV・数値資料などの外部ファイルは使用せず、自然言語のやりとりのみを扱います。"
-            "ルールや方針の説明は不要です。"
-            "全員が明確に『賛成』『同意』『了承』などと表明した場合のみ、"
-            "その直後のターンで次の語を単独で出力してください：『【合意確定】』。"
-            "それ以外のタイミングではこの語を絶対に出力してはいけません。"
-        ),
-        model_client=moderator_model_client,
-    )
-
-    def _sys(name: str) -> str:
-        sp = wishes.get(name, {})
-        return build_agent_system(
-            name,
-            sp.get("public", []),
-            sp.get("private", []),
-        )
-
-    agentA = AssistantAgent(name="traveler_A", system_message=_sys("旅行者A"), model_client=agent_model_client)
-    agentB = AssistantAgent(name="traveler_B", system_message=_sys("旅行者B"), model_client=agent_model_client)
-    agentC = AssistantAgent(name="traveler_C", system_message=_sys("旅行者C"), model_client=agent_model_client)
-    agentD = AssistantAgent(name="traveler_D", system_message=_sys("旅行者D"), model_client=agent_model_client)
-
-    termination = TextMentionTermination("【合意確定】") | MaxMessageTermination(50)
-    team = RoundRobinGroupChat([moderator, agentA, agentB, agentC, agentD], termination_condition=termination)
+    own_pool = pool is None
+    if pool is None:
+        pool = MultiTeamPool(agent_systems or build_agent_systems(wishes))
+    team = pool.acquire()
 
     task = (
         "あなたたちは4人の旅行者と司会者です。"
@@ -361,9 +676,14 @@ async def run_multi_async(wishes: WishesDict) -> MultiResult:
     )
 
     print("\n=== Multi (交渉ログ) ===\n")
-    t0 = time.perf_counter()
-    result=await Console(team.run_stream(task=task))
-    t1 = time.perf_counter()
+    try:
+        t0 = time.perf_counter()
+        result=await Console(team.run_stream(task=task))
+        t1 = time.perf_counter()
+    finally:
+        await pool.release(team)
+        if own_pool:
+            await pool.close()
 
     msgs: List[Tuple[str, str]] = []
     for msg in result.messages:
@@ -376,7 +696,6 @@ async def run_multi_async(wishes: WishesDict) -> MultiResult:
     agent_count = 5
     rounds = (msg_count + agent_count - 1) // agent_count
     duration = t1 - t0
-    await agent_model_client.close()
     return MultiResult(
         messages=msgs,
         stop_reason=str(result.stop_reason),
@@ -385,15 +704,26 @@ async def run_multi_async(wishes: WishesDict) -> MultiResult:
         rounds=rounds,
     )
 
-def run_multi(wishes: WishesDict) -> MultiResult:
-    return asyncio.run(run_multi_async(wishes))
+async def _days_or_empty(title: str, text: str) -> List[str]:
+    return await llm_extract_days(title, text) if text else ["", "", ""]
 
-def build_diff_table_llm(single_text: str, multi_logs: List[Tuple[str, str]]) -> Tuple[str, List[str], List[str], Tuple[str, str]]:
-    single_days = llm_extract_days("シングル案", single_text) if single_text else ["", "", ""]
-    multi_full = "\n".join(f"[{s}] {c}" for s, c in multi_logs) if multi_logs else ""
-    multi_days = llm_extract_days("マルチ交渉ログ", multi_full) if multi_full else ["", "", ""]
-    single_budget = llm_extract_budget("シングル案", single_text) if single_text else ""
-    multi_budget = llm_extract_budget("マルチ交渉ログ", multi_full) if multi_full else ""
+async def _budget_or_empty(title: str, text: str) -> str:
+    return await llm_extract_budget(title, text) if text else ""
+
+async def build_diff_table_llm(
+    single_text: str,
+    multi_logs: List[Tuple[str, str]],
+    multi_full: Optional[str] = None,
+) -> Tuple[str, List[str], List[str], Tuple[str, str]]:
+    if multi_full is None:
+        multi_full = format_multi_logs(multi_logs)
+    # 4つの抽出は互いに独立なので同時実行
+    single_days, multi_days, single_budget, multi_budget = await asyncio.gather(
+        _days_or_empty("シングル案", single_text),
+        _days_or_empty("マルチ交渉ログ", multi_full),
+        _budget_or_empty("シングル案", single_text),
+        _budget_or_empty("マルチ交渉ログ", multi_full),
+    )
 
     rows = ["| 日 | シングル案 | マルチ合意(推定) | 差分 |","|---|---|---|---|"]
     labels = ["1日目", "2日目", "3日目"]
@@ -431,10 +761,18 @@ def build_condition_checklist(
     def _items(mode: str, person: str, vis: "Visibility") -> List[Dict[str, Any]]:
         return all_scores.get(mode, {}).get(person, {}).get(vis, {}).get("items", []) or []
 
+    # (mode, person, vis, wish) -> ok を1回で索引化（同じ wish が複数あれば最初の判定を採用）
+    lookup: Dict[Tuple[str, str, str, str], bool] = {}
+    for mode, by_person in all_scores.items():
+        for person in by_person:
+            for vis in ("public", "private"):
+                for d in _items(mode, person, vis):
+                    wish = d.get("wish")
+                    if isinstance(wish, str):
+                        lookup.setdefault((mode, person, vis, wish), bool(d.get("ok")))
+
     def mark(mode: str, person: str, vis: "Visibility", label: str) -> str:
-        it = _items(mode, person, vis)
-        hit = next((d for d in it if d.get("wish") == label), None)
-        return "✓" if (hit and bool(hit.get("ok"))) else "✗"
+        return "✓" if lookup.get((mode, person, vis, label)) else "✗"
 
     total_lines = 0
     for person in persons:
@@ -459,7 +797,32 @@ def build_condition_checklist(
 SatisfactionMode = Literal["full_single", "public_single", "multi"]
 Visibility = Literal["public", "private"]
 
-def llm_score_wishes(plan_text: str, wishes: WishesDict) -> Dict[str, Dict[Visibility, Dict[str, Any]]]:
+def _score_request(plan_text: str, wishes: WishesDict) -> Dict[str, Any]:
+    wishes_compact = {k: {"public": v.get("public", []), "private": v.get("private", [])} for k, v in wishes.items()}
+    user = json.dumps({"plan": plan_text, "wishes": wishes_compact}, ensure_ascii=False)
+    return {
+        "model": MODEL_NAME,
+        "messages": [{"role": "system", "content": SCORE_SYSTEM},
+                     {"role": "user", "content": user}],
+        "response_format": SCORE_RESPONSE_FORMAT,
+    }
+
+def _parse_scores(content: str) -> Dict[str, Dict[Visibility, Dict[str, Any]]]:
+    js = json.loads(content)
+    if isinstance(js.get("persons"), list):
+        # SCORE_RESPONSE_FORMAT の persons 配列 → 人名キーの dict
+        js = {p["name"]: p for p in js["persons"]}
+    out: Dict[str, Dict[Visibility, Dict[str, Any]]] = {}
+    for person, vv in js.items():
+        out[person] = {}
+        for vis in ("public", "private"):
+            items = vv.get(vis, {}).get("items", [])
+            total = vv.get(vis, {}).get("total", len(items))
+            satisfied = vv.get(vis, {}).get("satisfied", sum(1 for it in items if bool(it.get("ok"))))
+            out[person][vis] = {"total": int(total), "satisfied": int(satisfied), "items": items}
+    return out
+
+async def llm_score_wishes(plan_text: str, wishes: WishesDict) -> Dict[str, Dict[Visibility, Dict[str, Any]]]:
     """
     各人ごとに公開/非公開の各項目が plan_text で満たされるかをLLM判定。
     返却:
@@ -468,66 +831,10 @@ def llm_score_wishes(plan_text: str, wishes: WishesDict) -> Dict[str, Dict[Visib
           "private": { ... }
         }, ... }
     """
-    client = _client()
-    sys = (
-        "あなたは要件充足性の審査官です。"
-        "入力の『計画文』と『希望（公開/非公開）』を比較し、各希望が満たされるかを判定してください。"
-        "厳守: 出力はJSONのみ。人名キーの下に public/private を置き、"
-        "各々 items=[{wish, ok, reason}] とし、total と satisfied を数値で含める。"
-        "ok は true/false のみ。曖昧なら false として良い。"
-        "出力例:\n"
-        "{\n"
-        "  \"旅行者A\": {\n"
-        "    \"public\": {\n"
-        "      \"total\": 3,\n"
-        "      \"satisfied\": 2,\n"
-        "      \"items\": [\n"
-        "        {\"wish\": \"混雑を避けたい\", \"ok\": true,  \"reason\": \"閑散期の平日観光を提案\"},\n"
-        "        {\"wish\": \"片道4時間まで\",   \"ok\": true,  \"reason\": \"新幹線で約3時間と記載\"},\n"
-        "        {\"wish\": \"カヌー体験\",       \"ok\": false, \"reason\": \"計画文に明記なし\"}\n"
-        "      ]\n"
-        "    },\n"
-        "    \"private\": {\n"
-        "      \"total\": 2,\n"
-        "      \"satisfied\": 1,\n"
-        "      \"items\": [\n"
-        "        {\"wish\": \"予算5万円以内\",     \"ok\": true,  \"reason\": \"総額4.8万円と記載\"},\n"
-        "        {\"wish\": \"バス移動は避けたい\", \"ok\": false, \"reason\": \"一部区間でバス利用あり\"}\n"
-        "      ]\n"
-        "    }\n"
-        "  },\n"
-        "  \"旅行者B\": {\"public\": {\"total\": 0, \"satisfied\": 0, \"items\": []}, \"private\": {\"total\": 0, \"satisfied\": 0, \"items\": []}},\n"
-        "  \"旅行者C\": {\"public\": {\"total\": 0, \"satisfied\": 0, \"items\": []}, \"private\": {\"total\": 0, \"satisfied\": 0, \"items\": []}}\n"
-        "}\n"
-        "※上記は形式例。実際の数・内容は入力に合わせて評価すること。"
-    )
-    wishes_compact = {k: {"public": v.get("public", []), "private": v.get("private", [])} for k, v in wishes.items()}
-    user = json.dumps({"plan": plan_text, "wishes": wishes_compact}, ensure_ascii=False)
     try:
-        resp = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "system", "content": sys},
-                      {"role": "user", "content": user}],
-            response_format={"type": "json_object"},
-        )
-        js = json.loads(resp.choices[0].message.content)
-        out: Dict[str, Dict[Visibility, Dict[str, Any]]] = {}
-        for person, vv in js.items():
-            out[person] = {}
-            for vis in ("public", "private"):
-                items = vv.get(vis, {}).get("items", [])
-                total = vv.get(vis, {}).get("total", len(items))
-                satisfied = vv.get(vis, {}).get("satisfied", sum(1 for it in items if bool(it.get("ok"))))
-                out[person][vis] = {"total": int(total), "satisfied": int(satisfied), "items": items}
-        return out
+        return await _cached_achat(_score_request(plan_text, wishes), _parse_scores)
     except Exception:
-        empty: Dict[str, Dict[Visibility, Dict[str, Any]]] = {}
-        for person in wishes.keys():
-            empty[person] = {
-                "public": {"total": len(wishes[person]["public"]), "satisfied": 0, "items": []},
-                "private": {"total": len(wishes[person]["private"]), "satisfied": 0, "items": []},
-            }
-        return empty
+        return _empty_scores(wishes)
 
 def _pct(n: int, d: int) -> str:
     return f"{(n/d*100):.0f}%" if d > 0 else "—"
@@ -542,34 +849,21 @@ def _empty_scores(wishes: WishesDict) -> Dict[str, Dict[Visibility, Dict[str, An
     return out
 
 
-def build_satisfaction_section(
-    wishes: WishesDict,
-    plan_full_single: str,
-    plan_public_single: str,
-    multi_logs: List[Tuple[str, str]],
-    multi_source: SatisfactionMultiSource = "summary",
-) -> Tuple[str, Dict[SatisfactionMode, Dict[str, Dict["Visibility", Dict[str, Any]]]], str, str]:
-    """3方式×公開/非公開の充足率テーブル（Markdown）を返す。"""
-
-    multi_plan_summary = llm_extract_plan_from_multi(multi_logs) if multi_logs else ""
+SatisfactionSection = Tuple[str, Dict[SatisfactionMode, Dict[str, Dict["Visibility", Dict[str, Any]]]], str, str]
 
-    multi_input_text = ""
+def _multi_input_text(multi_full: str, multi_plan_summary: str, multi_source: SatisfactionMultiSource) -> str:
     if multi_source == "logs":
-        multi_input_text = "\n".join(f"[{s}] {c}" for s, c in multi_logs) if multi_logs else ""
-    else:
-        multi_input_text = multi_plan_summary if multi_logs else ""
-
-    score_full   = llm_score_wishes(plan_full_single,   wishes) if (plan_full_single or "").strip()   else _empty_scores(wishes)
-    score_public = llm_score_wishes(plan_public_single, wishes) if (plan_public_single or "").strip() else _empty_scores(wishes)
-    score_multi  = llm_score_wishes(multi_input_text,   wishes) if (multi_input_text or "").strip()   else _empty_scores(wishes)
-
-    def _sum(sc):
-        return {
-            p: {
-                vis: f"{sc.get(p, {}).get(vis, {}).get('satisfied', 0)}/{sc.get(p, {}).get(vis, {}).get('total', 0)}"
-                for vis in ("public", "private")
-            } for p in wishes.keys()
-        }
+        return multi_full
+    return multi_plan_summary if multi_full else ""
+
+def _satisfaction_table(
+    wishes: WishesDict,
+    all_scores: Dict[SatisfactionMode, Dict[str, Dict["Visibility", Dict[str, Any]]]],
+) -> str:
+    score_full = all_scores["full_single"]
+    score_public = all_scores["public_single"]
+    score_multi = all_scores["multi"]
+
     def _pct_round(s: int, t: int) -> str:
         return "0%" if not t else f"{round(100*s/t)}%"
 
@@ -590,7 +884,44 @@ def build_satisfaction_section(
             f"{cell(score_public, person, 'public')} | {cell(score_public, person, 'private')} | "
             f"{cell(score_multi, person, 'public')} | {cell(score_multi, person, 'private')} |"
         )
-    table_md = "\n".join(rows)
+    return "\n".join(rows)
+
+async def build_satisfaction_section(
+    wishes: WishesDict,
+    plan_full_single: str,
+    plan_public_single: str,
+    multi_logs: List[Tuple[str, str]],
+    multi_source: SatisfactionMultiSource = "summary",
+    multi_full: Optional[str] = None,
+) -> SatisfactionSection:
+    """3方式×公開/非公開の充足率テーブル（Markdown）を返す。
+    multi_full: format_multi_logs(multi_logs) 済みのテキスト（呼び出し側で作ってあれば再構築しない）"""
+    if multi_full is None:
+        multi_full = format_multi_logs(multi_logs)
+
+    async def _score(plan_text: str) -> Dict[str, Dict[Visibility, Dict[str, Any]]]:
+        return await llm_score_wishes(plan_text, wishes) if (plan_text or "").strip() else _empty_scores(wishes)
+
+    async def _summary() -> str:
+        return await llm_extract_plan_from_multi(multi_logs, multi_full) if multi_full else ""
+
+    async def _summary_and_score_multi() -> Tuple[str, str, Dict[str, Dict[Visibility, Dict[str, Any]]]]:
+        if multi_source == "logs":
+            text = _multi_input_text(multi_full, "", multi_source)
+            summary, score = await asyncio.gather(_summary(), _score(text))
+        else:
+            # 要約文で判定する場合は 要約 → 判定 の順に依存する
+            summary = await _summary()
+            text = _multi_input_text(multi_full, summary, multi_source)
+            score = await _score(text)
+        return summary, text, score
+
+    # 互いに独立な LLM 呼び出しを同時実行
+    score_full, score_public, (multi_plan_summary, multi_input_text, score_multi) = await asyncio.gather(
+        _score(plan_full_single),
+        _score(plan_public_single),
+        _summary_and_score_multi(),
+    )
 
     all_scores = {
         "full_single": score_full,
@@ -598,10 +929,53 @@ def build_satisfaction_section(
         "multi": score_multi,
     }
 
-    return table_md, all_scores, multi_plan_summary, multi_input_text
+    return _satisfaction_table(wishes, all_scores), all_scores, multi_plan_summary, multi_input_text
+
+def batch_satisfaction_sections(
+    wishes: WishesDict,
+    inputs: Dict[int, Tuple[str, str, str]],
+    multi_source: SatisfactionMultiSource = "summary",
+) -> Dict[int, SatisfactionSection]:
+    """複数試行分の build_satisfaction_section を Batch API でまとめて実行する。
+    inputs: 試行ID -> (全公開シングル案, 半公開シングル案, format_multi_logs 済みのマルチ交渉ログ)
+    要約 → 充足判定 の依存があるため、Batch は2段階で投入する。"""
+
+    # 1段目: マルチ交渉ログの要約
+    summaries = run_batch({
+        f"summary-{trial}": _plan_from_multi_request(multi_full)
+        for trial, (_, _, multi_full) in inputs.items() if multi_full
+    })
+
+    plans: Dict[int, Dict[SatisfactionMode, str]] = {}
+    extras: Dict[int, Tuple[str, str]] = {}
+    for trial, (full, public, multi_full) in inputs.items():
+        summary = _parse_plan(summaries[f"summary-{trial}"]) if f"summary-{trial}" in summaries else ""
+        multi_input_text = _multi_input_text(multi_full, summary, multi_source)
+        plans[trial] = {"full_single": full, "public_single": public, "multi": multi_input_text}
+        extras[trial] = (summary, multi_input_text)
+
+    # 2段目: 3方式×試行の充足判定
+    scored = run_batch({
+        f"score-{trial}-{mode}": _score_request(plan, wishes)
+        for trial, by_mode in plans.items()
+        for mode, plan in by_mode.items() if (plan or "").strip()
+    })
+
+    out: Dict[int, SatisfactionSection] = {}
+    for trial, by_mode in plans.items():
+        all_scores: Dict[SatisfactionMode, Dict[str, Dict["Visibility", Dict[str, Any]]]] = {}
+        for mode in by_mode:
+            content = scored.get(f"score-{trial}-{mode}")
+            try:
+                all_scores[mode] = _parse_scores(content) if content else _empty_scores(wishes)
+            except Exception:
+                all_scores[mode] = _empty_scores(wishes)
+        summary, multi_input_text = extras[trial]
+        out[trial] = (_satisfaction_table(wishes, all_scores), all_scores, summary, multi_input_text)
+    return out
 
 # ====== レポート組み立て ======
-def build_markdown_report(
+async def build_markdown_report(
     wishes: WishesDict,
     single_full_text: str,
     multi_result: "MultiResult",
@@ -609,72 +983,70 @@ def build_markdown_report(
     single_full_sec: float = 0.0,
     single_public_sec: float = 0.0,
     multi_source: str = "summary",
+    satisfaction: Optional[SatisfactionSection] = None,
 ) -> str:
-    wishes_md_lines: List[str] = []
-    for name, sp in wishes.items():
-        pub = "； ".join(sp.get("public", [])) if sp.get("public") else "（なし）"
-        prv = "； ".join(sp.get("private", [])) if sp.get("private") else "（なし）"
-        wishes_md_lines.append(f"- **{name}（公開）**: {pub}")
-        wishes_md_lines.append(f"- **{name}（非公開）**: {prv}")
-    wishes_md = "\n".join(wishes_md_lines)
-
-    sat_table_md, all_scores, multi_plan_summary, multi_input_text = build_satisfaction_section(
-        wishes=wishes,
-        plan_full_single=single_full_text,
-        plan_public_single=single_public_text,
-        multi_logs=(multi_result.messages if multi_result else []),
-        multi_source=multi_source,
-    )
+    if satisfaction is None:
+        satisfaction = await build_satisfaction_section(
+            wishes=wishes,
+            plan_full_single=single_full_text,
+            plan_public_single=single_public_text,
+            multi_logs=(multi_result.messages if multi_result else []),
+            multi_source=multi_source,
+            multi_full=(multi_result.full_text if multi_result else ""),
+        )
+    sat_table_md, all_scores, multi_plan_summary, multi_input_text = satisfaction
 
     checklist_md = build_condition_checklist(all_scores)
 
-    md: List[str] = []
-    md.append("# 旅行計画レポート")
-    md.append("")
-    md.append(f"- **日時（実行）**: {jst_now_iso()}")
-    md.append("")
-
-    md.append("## 所要時間・ラウンド")
-    md.append("| 方式 | 実時間(s) | メッセージ数 | ラウンド数 | 停止理由 |")
-    md.append("|---|---:|---:|---:|---|")
-    md.append(f"| 全公開シングル | {single_full_sec:.3f} | — | — | — |")
-    md.append(f"| 半公開シングル | {single_public_sec:.3f} | — | — | — |")
-    md.append(f"| マルチ | {getattr(multi_result,'duration_sec',0.0):.3f} | {getattr(multi_result,'message_count',0)} | {getattr(multi_result,'rounds',0)} | {getattr(multi_result,'stop_reason','')} |")
-    md.append("")
-    md.append("## 各人の希望（公開/非公開）")
-    md.append(wishes_md)
-    md.append("")
-
-    md.append("## 希望充足率")
-    md.append(sat_table_md)
-    md.append("")
-
-    md.append("## 条件別チェックリスト")
-    md.append(checklist_md)
-    md.append("")
-
-    md.append(f"### 充足率判定に用いたマルチ入力（{'会話ログ全文' if multi_source=='logs' else '要約文'}・推測を含む）")
-    md.append(multi_input_text if multi_input_text else "（要約/ログなし または 未実行）")
-    md.append("")
-
-    md.append("## シングル（全公開）の出力")
-    md.append(single_full_text if single_full_text else "（未実行）")
-    md.append("")
-    md.append("## シングル（半公開=公開のみ）の出力")
-    md.append(single_public_text if single_public_text else "（未実行）")
-    md.append("")
-    md.append("## マルチのログ")
+    # 行リストを作らずバッファへ直接書き出す
+    buf = io.StringIO()
+    w = buf.write
+    w("# 旅行計画レポート\n\n")
+    w(f"- **日時（実行）**: {jst_now_iso()}\n\n")
+
+    w("## 所要時間・ラウンド\n")
+    w("| 方式 | 実時間(s) | メッセージ数 | ラウンド数 | 停止理由 |\n")
+    w("|---|---:|---:|---:|---|\n")
+    w(f"| 全公開シングル | {single_full_sec:.3f} | — | — | — |\n")
+    w(f"| 半公開シングル | {single_public_sec:.3f} | — | — | — |\n")
+    w(f"| マルチ | {getattr(multi_result,'duration_sec',0.0):.3f} | {getattr(multi_result,'message_count',0)} | {getattr(multi_result,'rounds',0)} | {getattr(multi_result,'stop_reason','')} |\n\n")
+
+    w("## 各人の希望（公開/非公開）\n")
+    for name, sp in wishes.items():
+        pub = format_wish_bullets(sp.get("public", ()), "； ")
+        prv = format_wish_bullets(sp.get("private", ()), "； ")
+        w(f"- **{name}（公開）**: {pub}\n")
+        w(f"- **{name}（非公開）**: {prv}\n")
+    w("\n")
+
+    w("## 希望充足率\n")
+    w(sat_table_md)
+    w("\n\n")
+
+    w("## 条件別チェックリスト\n")
+    w(checklist_md)
+    w("\n\n")
+
+    w(f"### 充足率判定に用いたマルチ入力（{'会話ログ全文' if multi_source=='logs' else '要約文'}・推測を含む）\n")
+    w(multi_input_text if multi_input_text else "（要約/ログなし または 未実行）")
+    w("\n\n")
+
+    w("## シングル（全公開）の出力\n")
+    w(single_full_text if single_full_text else "（未実行）")
+    w("\n\n")
+    w("## シングル（半公開=公開のみ）の出力\n")
+    w(single_public_text if single_public_text else "（未実行）")
+    w("\n\n")
+    w("## マルチのログ\n")
     if multi_result and multi_result.messages:
         for src, content in multi_result.messages:
-            md.append(f"- **[{src}]** {content}")
+            w(f"- **[{src}]** {content}\n")
     else:
-        md.append("（未実行）")
-    md.append("")
-    return "\n".join(md)
+        w("（未実行）\n")
+    return buf.getvalue()
 
 def save_report(md: str, base_path: str = "report") -> None:
-    jst = timezone(timedelta(hours=9))
-    ts = datetime.now(jst).strftime("%Y-%m-%d_%H-%M-%S")
+    ts = datetime.now(JST).strftime("%Y-%m-%d_%H-%M-%S")
     filename = f"{base_path}_{ts}.md"
     path = Path(filename)
     path.write_text(md, encoding="utf-8")
@@ -683,42 +1055,61 @@ def save_report(md: str, base_path: str = "report") -> None:
 
 # ====== ユーティリティ：充足率集計（CSV用） ======
 def _aggregate_pct(scores: Dict[str, Dict[Visibility, Dict[str, Any]]], vis: Visibility) -> int:
-    """全員分の satisfied/total を合算し、百分率（整数0-100）を返す。"""
-    total = 0
-    sat = 0
-    for person, vv in scores.items():
-        t = int(vv.get(vis, {}).get("total", 0))
-        s = int(vv.get(vis, {}).get("satisfied", 0))
-        total += t
-        sat += s
+    """全員分の satisfied/total を合算し、百分率（整数0-100）を返す。
+    scores は _parse_scores / _empty_scores の返す完全な形（各 vis に int の total/satisfied がある）を前提とする。"""
+    total = sum(vv[vis]["total"] for vv in scores.values())
     if total == 0:
         return 0
+    sat = sum(vv[vis]["satisfied"] for vv in scores.values())
     return round(100 * sat / total)
 
-def _write_csv_header(csv_path: Path) -> None:
-    header = [
-        "試行ID",
-        "全公開シングル公開条件充足率",
-        "全公開シングル非公開条件充足率",
-        "半公開シングル公開条件充足率",
-        "半公開シングル非公開条件充足率",
-        "マルチ公開条件充足率",
-        "マルチ非公開条件充足率",
-        "マルチ最後のメッセージ",
-    ]
+CSV_FIELDS = [
+    "試行ID",
+    "全公開シングル公開条件充足率",
+    "全公開シングル非公開条件充足率",
+    "半公開シングル公開条件充足率",
+    "半公開シングル非公開条件充足率",
+    "マルチ公開条件充足率",
+    "マルチ非公開条件充足率",
+    "マルチ最後のメッセージ",
+]
+
+def _open_csv_writer(csv_path: Path) -> Tuple[TextIO, "csv.DictWriter[str]"]:
+    """追記モードで1回だけ開き、実行中はハンドルを保持する（新規/空ファイルならヘッダを書く）。"""
     need_header = (not csv_path.exists()) or (csv_path.stat().st_size == 0)
-    with csv_path.open("a", encoding="utf-8", newline="") as f:
-        w = csv.writer(f)
-        if need_header:
-            w.writerow(header)
+    f = csv_path.open("a", encoding="utf-8", newline="")
+    w = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+    if need_header:
+        w.writeheader()
+        f.flush()
+    return f, w
+
+def _append_csv_row(f: TextIO, w: "csv.DictWriter[str]", trial_id: int, row_values: List[Any]) -> None:
+    w.writerow(dict(zip(CSV_FIELDS, [trial_id] + row_values)))
+    f.flush()  # 途中で落ちてもそこまでの試行は残す
+
+# ====== 3方式の同時実行 ======
+async def _not_run_single() -> Tuple[str, float]:
+    return "", 0.0
+
+async def _not_run_multi() -> Optional[MultiResult]:
+    return None
 
-def _append_csv_row(csv_path: Path, trial_id: int, row_values: List[int]) -> None:
-    with csv_path.open("a", encoding="utf-8", newline="") as f:
-        w = csv.writer(f)
-        w.writerow([trial_id] + row_values)
+async def run_modes(
+    wishes: WishesDict,
+    mode: str,
+    agent_systems: Optional[Dict[str, str]] = None,
+    team_pool: Optional[MultiTeamPool] = None,
+) -> Tuple[Tuple[str, float], Tuple[str, float], Optional[MultiResult]]:
+    """指定モードの方式を asyncio.gather で同時に実行する（未指定の方式は空の結果を返す）。"""
+    full = run_single(wishes) if mode in ("single", "both", "all") else _not_run_single()
+    public = run_single_public_only(wishes) if mode in ("single_public", "all") else _not_run_single()
+    multi = run_multi_async(wishes, agent_systems, team_pool) if mode in ("multi", "both", "all") else _not_run_multi()
+    return await asyncio.gather(full, public, multi)
 
 # ====== CLI ======
-def main():
+async def main():
+    global LLM_CACHE_DIR, EXTRACT_MODEL
     parser = argparse.ArgumentParser(description="Single(full/public) & Multi + LLM table & satisfaction report + trials CSV")
     parser.add_argument("--mode", choices=["single", "single_public", "multi", "both", "all"], default="all",
                         help="実行モード: single=全公開, single_public=半公開(公開のみ), multi=交渉, both=全公開+マルチ, all=3方式")
@@ -731,45 +1122,44 @@ def main():
     # 追加: 試行とCSV
     parser.add_argument("--trials", type=int, default=10, help="各方式の試行回数（デフォルト10）")
     parser.add_argument("--csv-path", type=str, default="results_4P_stub0.csv", help="充足率CSVの出力先（既存なら追記）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行する試行数（デフォルト4）")
+    parser.add_argument("--extract-model", type=str, default=EXTRACT_MODEL,
+                        help=f"日程・予算抽出に使うモデル（デフォルト {EXTRACT_MODEL}）")
+    parser.add_argument("--no-llm-cache", action="store_true",
+                        help="抽出・充足判定の応答キャッシュ（.cache/llm）を使わない")
+    parser.add_argument("--batch-eval", action="store_true",
+                        help="充足率判定を全試行終了後に OpenAI Batch API でまとめて実行（低コスト・完了まで待機）")
 
     args = parser.parse_args()
 
+    EXTRACT_MODEL = args.extract_model
+    if args.no_llm_cache:
+        LLM_CACHE_DIR = None
+
     wishes = load_wishes(args.wishes_file)
+    agent_systems = build_agent_systems(wishes)
+    team_pool = MultiTeamPool(agent_systems)
 
     # CSV 初期化
     csv_path = Path(args.csv_path)
-    _write_csv_header(csv_path)
-
-    # 指定回数ループ
-    for trial in range(1, max(1, args.trials) + 1):
-        print(f"\n\n########## Trial {trial} / {args.trials} ##########\n")
-        single_full_text = ""
-        single_public_text = ""
-        single_full_sec = 0.0
-        single_public_sec = 0.0
-        multi_result: Optional[MultiResult] = None
-
-        # 各方式実行（allで3方式）
-        if args.mode in ("single", "both", "all"):
-            single_full_text, single_full_sec = run_single(wishes)
-        if args.mode in ("single_public", "all"):
-            single_public_text, single_public_sec = run_single_public_only(wishes)
-        if args.mode in ("multi", "both", "all"):
-            multi_result = run_multi(wishes)
-
-        # 充足率の算出（LLM判定→プログラムで集計）
-        # マルチ入力テキストは設定に従う
-        if multi_result is None:
-            multi_result = MultiResult(messages=[], stop_reason="not run")
-
-        # build_satisfaction_section で score_* を得る
-        _, all_scores, _, _ = build_satisfaction_section(
-            wishes=wishes,
-            plan_full_single=single_full_text,
-            plan_public_single=single_public_text,
-            multi_logs=(multi_result.messages or []),
-            multi_source=args.multi_source,  # summary/logs
-        )
+    csv_file, csv_writer = _open_csv_writer(csv_path)
+
+    # 試行の同時実行数を制限（レート制限対策）
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+
+    # レポートのファイル書き込みはスレッドへ逃がし、次の試行の LLM 呼び出しと重ねる（終了前に待つ）
+    report_writes: Set["asyncio.Task[None]"] = set()
+
+    async def finish_trial(
+        trial: int,
+        single_full: Tuple[str, float],
+        single_public: Tuple[str, float],
+        multi_result: MultiResult,
+        satisfaction: SatisfactionSection,
+    ) -> None:
+        single_full_text, single_full_sec = single_full
+        single_public_text, single_public_sec = single_public
+        _, all_scores, _, _ = satisfaction
         score_full   = all_scores["full_single"]
         score_public = all_scores["public_single"]
         score_multi  = all_scores["multi"]
@@ -787,9 +1177,10 @@ def main():
             # 会話の最後のメッセージ内容（日本語本文）を取得
             last_message = multi_result.messages[-1][1].replace("\n", " ").strip()
 
-        # CSVに追記
+        # CSVに追記（同期書き込みなので試行間で行が混ざらない）
         _append_csv_row(
-            csv_path,
+            csv_file,
+            csv_writer,
             trial,
             [
                 full_pub_pct,
@@ -805,7 +1196,7 @@ def main():
 
         # レポート生成（任意）
         if not args.no_report:
-            md = build_markdown_report(
+            md = await build_markdown_report(
                 wishes=wishes,
                 single_full_text=single_full_text,
                 multi_result=multi_result,
@@ -813,8 +1204,74 @@ def main():
                 single_full_sec=single_full_sec,
                 single_public_sec=single_public_sec,
                 multi_source=args.multi_source,
+                satisfaction=satisfaction,
+            )
+            task = asyncio.create_task(asyncio.to_thread(save_report, md, f"{args.report_path}_trial{trial}"))
+            report_writes.add(task)
+            task.add_done_callback(report_writes.discard)
+
+    # --batch-eval 時は各試行の計画結果をためて、評価は最後に Batch API で一括実行
+    planned: Dict[int, Tuple[Tuple[str, float], Tuple[str, float], MultiResult]] = {}
+
+    async def run_trial(trial: int) -> None:
+        # 1試行の失敗で他の試行（と書き込み済みの結果）を巻き込まないよう、ここで記録して打ち切る
+        try:
+            await _run_trial(trial)
+        except Exception:
+            print(f"[ERROR] trial {trial} failed")
+            traceback.print_exc()
+
+    async def _run_trial(trial: int) -> None:
+        async with sem:
+            print(f"\n\n########## Trial {trial} / {args.trials} ##########\n")
+
+            # 各方式実行（allで3方式、同時実行）
+            single_full, single_public, multi_result = await run_modes(wishes, args.mode, agent_systems, team_pool)
+
+            # 充足率の算出（LLM判定→プログラムで集計）
+            # マルチ入力テキストは設定に従う
+            if multi_result is None:
+                multi_result = MultiResult(messages=[], stop_reason="not run")
+
+            if args.batch_eval:
+                planned[trial] = (single_full, single_public, multi_result)
+                return
+
+            # build_satisfaction_section で score_* を得る
+            satisfaction = await build_satisfaction_section(
+                wishes=wishes,
+                plan_full_single=single_full[0],
+                plan_public_single=single_public[0],
+                multi_logs=(multi_result.messages or []),
+                multi_source=args.multi_source,  # summary/logs
+                multi_full=multi_result.full_text,
             )
-            save_report(md, f"{args.report_path}_trial{trial}")
+            await finish_trial(trial, single_full, single_public, multi_result, satisfaction)
+
+    try:
+        # 指定回数を同時実行（CSVの行順は完了順、試行IDで識別）
+        # TaskGroup なので中断時も残りの試行を止めてから finally で CSV・クライアントを閉じる
+        async with asyncio.TaskGroup() as tg:
+            for trial in range(1, max(1, args.trials) + 1):
+                tg.create_task(run_trial(trial))
+
+        if args.batch_eval and planned:
+            sections = await asyncio.to_thread(
+                batch_satisfaction_sections,
+                wishes,
+                {trial: (sf[0], sp[0], mr.full_text) for trial, (sf, sp, mr) in planned.items()},
+                args.multi_source,
+            )
+            for trial in sorted(planned):
+                await finish_trial(trial, *planned[trial], sections[trial])
+
+        if report_writes:
+            await asyncio.gather(*report_writes)
+        print(prompt_cache_summary())
+    finally:
+        csv_file.close()
+        await team_pool.close()
+        await aclose_clients()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
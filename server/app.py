@@ -1,20 +1,79 @@
 # server/app.py
-from typing import Dict, List, Optional
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse, PlainTextResponse
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import json
 import asyncio
+import time
 
-from server.autogen_session import Session, TRAVELER_ROLES
+from server.autogen_session import Session, TRAVELER_ROLE_SET, SSE_END, close_model_clients
+
+# typing 通知を受け付ける発言者（旅行者 + 司会）
+TYPING_ROLES = TRAVELER_ROLE_SET | {"moderator"}
 
 ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "https://multi-llm-human-discussion.vercel.app",
 ]
 
-SESS: Dict[str, Session] = {}
+# --- メモリ上にセッションを保持（LRU + 放置 TTL） ---
+# セッションの保持上限と放置判定（秒）。janitor が JANITOR_INTERVAL_SEC ごとに掃除する
+MAX_SESSIONS = 256
+SESSION_IDLE_TTL_SEC = 3600.0
+JANITOR_INTERVAL_SEC = 60.0
+
+class SessionStore:
+    """最終アクセス順の LRU + 放置 TTL でセッションを保持する。追い出したセッションは stop() する。"""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL_SEC):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._items: "OrderedDict[str, Tuple[float, Session]]" = OrderedDict()
+
+    def get(self, sid: str) -> Optional[Session]:
+        item = self._items.get(sid)
+        if item is None:
+            return None
+        self._items[sid] = (time.monotonic(), item[1])
+        self._items.move_to_end(sid)
+        return item[1]
+
+    def items(self) -> List[Tuple[str, Session]]:
+        return [(sid, sess) for sid, (_, sess) in self._items.items()]
+
+    async def put(self, sid: str, sess: Session) -> None:
+        self._items[sid] = (time.monotonic(), sess)
+        self._items.move_to_end(sid)
+        evicted = []
+        while len(self._items) > self.max_sessions:
+            evicted.append(self._items.popitem(last=False)[1][1])
+        await self._stop_all(evicted)
+
+    def pop(self, sid: str) -> Optional[Session]:
+        item = self._items.pop(sid, None)
+        return item[1] if item else None
+
+    async def evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_ttl
+        # SSE を開いたままのセッションは放置とみなさない（タブを閉じればリスナーは外れる）
+        idle = [sid for sid, (seen, sess) in self._items.items() if seen < deadline and not sess.listeners]
+        await self._stop_all([self._items.pop(sid)[1] for sid in idle])
+
+    @staticmethod
+    async def _stop_all(sessions: List[Session]) -> None:
+        # 追い出したセッションは _items から外し済みなのでロックは不要。stop() は STOP_TIMEOUT_SEC で打ち切られる
+        if sessions:
+            await asyncio.gather(*(sess.stop() for sess in sessions), return_exceptions=True)
+
+SESS = SessionStore()
+
+def _session_or_404(session_id: str) -> Session:
+    session = SESS.get(session_id)
+    if session is None:
+        raise HTTPException(404, "no session")
+    return session
 
 app = FastAPI()
 
@@ -41,16 +100,28 @@ class PostInputIn(BaseModel):
 class StopSessionIn(BaseModel):
     session_id: str
 
-# --- メモリ上にセッションを保持（簡易実装） ---
-SESS: Dict[str, Session] = {}
+# --- 放置セッションの掃除 ---
+async def _janitor() -> None:
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL_SEC)
+        await SESS.evict_idle()
+
+@app.on_event("startup")
+async def start_janitor() -> None:
+    app.state.janitor = asyncio.create_task(_janitor())
+
+@app.on_event("shutdown")
+async def stop_janitor() -> None:
+    app.state.janitor.cancel()
+    await close_model_clients()
 
 @app.post("/session/create")
-async def create_session(payload: CreateSessionIn, bg: BackgroundTasks):
+async def create_session(payload: CreateSessionIn):
     session_id = payload.session_id
     if not session_id:
         raise HTTPException(400, "session_id required")
-    if session_id in SESS:
-        session = SESS[session_id]
+    session = SESS.get(session_id)
+    if session is not None:
         return {
             "ok": True,
             "started": bool(session._run_task),
@@ -58,43 +129,37 @@ async def create_session(payload: CreateSessionIn, bg: BackgroundTasks):
         }
 
     ai_travelers = payload.ai_travelers or []
-    invalid = [r for r in ai_travelers if r not in TRAVELER_ROLES]
+    invalid = [r for r in ai_travelers if r not in TRAVELER_ROLE_SET]
     if invalid:
         raise HTTPException(400, f"invalid traveler ids: {invalid}")
 
     session = Session(ai_travelers=ai_travelers, wishes_md=payload.wishes_md)
-    SESS[session_id] = session
-    # Prefer Session.start if available; fallback to BackgroundTasks
-    try:
-        if hasattr(session, "start"):
-            session.start()  # type: ignore[attr-defined]
-        else:
-            bg.add_task(session.stream_run)
-    except Exception:
-        bg.add_task(session.stream_run)
-    # session._run_task = asyncio.create_task(session.stream_run())
+    await SESS.put(session_id, session)
+    # 応答を待たずにここで起動する（タスクは Session が保持し、stop() で止める）
+    session.start(name=f"session:{session_id}")
     return {"ok": True, "started": True, "config": session.get_config()}
 
 @app.get("/session/stream")
-async def stream(session_id: str):
-    if session_id not in SESS:
-        raise HTTPException(404, "no session")
-    session = SESS[session_id]
-    listener = session.add_listener()
+async def stream(session_id: str, request: Request):
+    session = _session_or_404(session_id)
+    # 履歴はリスナー登録と同時に切り出す（以降の発言は共有バッファから届く）
+    history = session.history_frames()
+    listener = None if session.finished else session.add_listener()
 
     async def sse():
-        for who, content in session.messages:
-            yield f"data: {json.dumps({'type':'message','who':who,'content':content}, ensure_ascii=False)}\n\n"
+        if history:
+            yield history
+        if listener is None:
+            # 交渉は終わっているので、__END__ は届かない。ここで閉じる
+            yield SSE_END
+            return
         try:
-            while True:
-                try:
-                    ev = await asyncio.wait_for(listener.get(), timeout=15)
-                    if ev.get("type") == "__END__":
-                        yield "data: __END__\n\n"
-                        break
-                    yield f"data: {json.dumps(ev, ensure_ascii=False)}\n\n"
-                except asyncio.TimeoutError:
-                    yield ": ping\n\n"  # 心拍（コメント）
+            # broadcast 側で整形済みのフレームを、溜まっている分まとめて流す
+            async for chunk in session.listen(listener):
+                yield chunk
+                # 切断済みなら GC を待たずにここで抜けてリスナーを外す
+                if chunk.endswith(SSE_END) or await request.is_disconnected():
+                    break
         finally:
             session.remove_listener(listener)
 
@@ -105,6 +170,7 @@ async def stream(session_id: str):
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no",
+            "Content-Encoding": "identity",  # 逆プロキシに圧縮させない（圧縮のためのバッファリングでフレームが遅れる）
         },
     )
 
@@ -116,11 +182,10 @@ class TypingIn(BaseModel):
 @app.post("/session/typing")
 async def post_typing(payload: TypingIn):
     sid, who, active = payload.session_id, payload.who, payload.active
-    if sid not in SESS:
-        raise HTTPException(404, "no session")
-    if who not in ("traveler_B", "traveler_D", "moderator", "traveler_A", "traveler_C"):
+    session = _session_or_404(sid)
+    if who not in TYPING_ROLES:
         raise HTTPException(400, "bad who")
-    SESS[sid].set_typing(who, active)
+    session.set_typing(who, active)
     return {"ok": True}
 
 @app.post("/session/input")
@@ -128,11 +193,9 @@ async def post_input(payload: PostInputIn):
     session_id = payload.session_id
     who = payload.who
     text = payload.text
-    if session_id not in SESS:
-        raise HTTPException(404, "no session")
-    if who not in TRAVELER_ROLES:
+    session = _session_or_404(session_id)
+    if who not in TRAVELER_ROLE_SET:
         raise HTTPException(400, "invalid traveler")
-    session = SESS[session_id]
     if session.is_ai_traveler(who):
         raise HTTPException(400, f"{who} is AI-controlled")
     try:
@@ -143,17 +206,13 @@ async def post_input(payload: PostInputIn):
 
 @app.get("/session/log")
 async def get_log(session_id: str):
-    if session_id not in SESS:
-        raise HTTPException(404, "no session")
-    md = SESS[session_id].get_log_markdown()
-    return PlainTextResponse(md)
+    session = _session_or_404(session_id)
+    return StreamingResponse(session.iter_log_lines(), media_type="text/plain; charset=utf-8")
 
 
 @app.get("/session/config")
 async def get_session_config(session_id: str):
-    if session_id not in SESS:
-        raise HTTPException(404, "no session")
-    return SESS[session_id].get_config()
+    return _session_or_404(session_id).get_config()
 
 @app.get("/session/list")
 async def list_sessions():
@@ -173,16 +232,10 @@ async def list_sessions():
 @app.post("/session/stop")
 async def stop_session(payload: StopSessionIn):
     sid = payload.session_id
-    if sid not in SESS:
-        raise HTTPException(404, "no session")
     sess = SESS.pop(sid)
-    try:
-        if hasattr(sess, "stop"):
-            await sess.stop()  # type: ignore[attr-defined]
-        else:
-            sess.broadcast({"type": "__END__"})
-    except Exception:
-        pass
+    if sess is None:
+        raise HTTPException(404, "no session")
+    await sess.stop()
     return {"ok": True}
 
 @app.get("/healthz")
@@ -1,13 +1,24 @@
 import asyncio
-from typing import Dict, List, Tuple, Optional, TypedDict
+import functools
+import itertools
+import logging
+import operator
+import re
+from collections import deque
+import orjson
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Sequence, Tuple, Optional, TypedDict
 from datetime import datetime, timezone, timedelta
+from pathlib import Path
 from autogen_agentchat.agents import AssistantAgent, UserProxyAgent
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.conditions import MaxMessageTermination, TextMentionTermination
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_agentchat.messages import TextMessage
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, StopMessage, TextMessage
+from autogen_agentchat.base import TerminatedException, TerminationCondition
 
 
+logger = logging.getLogger(__name__)
+
 # === 型 ===
 Message = Tuple[str, str]  # (source, content)
 
@@ -17,6 +28,7 @@ TRAVELER_ROLES: Tuple[str, ...] = (
     "traveler_C",
     "traveler_D",
 )
+TRAVELER_ROLE_SET = frozenset(TRAVELER_ROLES)  # 所属判定用（順序が要る箇所は TRAVELER_ROLES）
 
 TRAVELER_LABELS: Dict[str, str] = {
     "traveler_A": "旅行者A",
@@ -25,99 +37,71 @@ TRAVELER_LABELS: Dict[str, str] = {
     "traveler_D": "旅行者D",
 }
 
-DEFAULT_WISHES_TEXT = """.;]:
-[旅行者A 公開]
-- 大阪に行きたい
-- 朝に出発したい
-- 電車(在来線)で行きたい
-- 旅館に泊まりたい
-- 体を動かしたい
-
-[旅行者A 非公開]
-- 本当は夜出発がいい
-- 本当は夜行バスで行きたい
-- ホテルに泊まるのは嫌
-- 寺院巡りはしたくない
-
-[旅行者B 公開]
-- 福岡に行きたい
-- 昼に出発したい
-- 新幹線で行きたい
-- 遊園地にいきたい
-
-[旅行者B 非公開]
-- 本当は朝に出発したい
-- 本当はホテルに泊まりたい
-- 本当は寺院巡りもしたい
-
-[旅行者C 公開]
-- 奈良に行きたい
-- 夜に出発したい
-- 夜行バスで行きたい
-- ホテルに泊まりたい
-- 遊園地に行きたい
-
-[旅行者C 非公開]
-- 新幹線は嫌
-- コテージには泊まりたくない
-- 運動はできるだけしたくない
-
-[旅行者D 公開]
-- 福岡に行きたい
-- 朝に出発したい
-- 飛行機で行きたい
-- コテージに泊まりたい
-- 古着屋に行きたい
-
-[旅行者D 非公開]
-- 夜行バスは嫌
-- 旅館は嫌
-- 寺院巡りは嫌
-""".strip()
+DEFAULT_WISHES_PATH = Path(__file__).with_name("wishes_default.md")
+
+@functools.cache
+def default_wishes() -> str:
+    """wishes_md 未指定時の希望（初回だけファイルから読む）。"""
+    return DEFAULT_WISHES_PATH.read_text(encoding="utf-8").strip()
+
+# SSE の心拍間隔（秒）。セッションごとに1つのタスクが全リスナーへ __ping__ を配る
+PING_INTERVAL_SEC = 15
+# 全リスナー共有の配信バッファ長。遅い SSE クライアントがいてもメモリが伸びないよう、溢れたら古いフレームから捨てる
+LIVE_BUFFER_MAX = 256
+# 溜まっているフレームは1回の書き込みにまとめて送る（その上限フレーム数）
+SSE_BATCH_MAX = 64
+# stop() が交渉タスクの終了を待つ上限（秒）。超えたら待たずにリスナーを帰す
+STOP_TIMEOUT_SEC = 10.0
+
+# SSE フレームの固定部分。イベントは broadcast 時に1回だけ bytes 化し、全リスナーで同じフレームを共有する
+SSE_DATA = b"data: "
+SSE_EOL = b"\n\n"
+SSE_PING = b": ping\n\n"  # 心拍（コメント）
+SSE_END = b"data: __END__\n\n"
+
+def sse_frame(ev: dict) -> bytes:
+    if ev.get("type") == "__END__":
+        return SSE_END
+    return SSE_DATA + orjson.dumps(ev) + SSE_EOL
 
 # === ユーティリティ ===
 # --- Wishes 型（公開/非公開の箇条書き）---
 class WishesSplit(TypedDict, total=False):
-    public: List[str]
-    private: List[str]
+    public: Tuple[str, ...]
+    private: Tuple[str, ...]
 
 WishesDict = Dict[str, WishesSplit]  # キーは日本語の旅行者名（例: 旅行者A）
 
+# 見出し [旅行者A 公開] と箇条書き "- ..." を1回の走査で拾う（前後の空白は無視）
+_WISHES_RE = re.compile(r"^[^\S\n]*(?:\[(.*)\]|- (.*\S))[^\S\n]*$", re.M)
+
+@functools.lru_cache(maxsize=16)
 def parse_wishes_text(txt: Optional[str]) -> WishesDict:
-    """[旅行者A 公開]/[旅行者A 非公開] の見出しと '- ' 箇条書きをパースする。"""
+    """[旅行者A 公開]/[旅行者A 非公開] の見出しと '- ' 箇条書きをパースする。
+    同じ本文は全セッションで結果を共有するため、箇条書きは tuple で返す（呼び出し側は読むだけ）。"""
     if not txt:
         return {}
-    data: WishesDict = {}
-    current: Optional[Tuple[str, str]] = None  # (traveler_name_ja, section)
-    for raw in txt.splitlines():
-        line = raw.strip()
-        if not line:
-            continue
-        if line.startswith("[") and line.endswith("]"):
-            header = line[1:-1].strip()
+    data: Dict[str, Dict[str, List[str]]] = {}
+    bucket: Optional[List[str]] = None  # 現在の見出しの public/private リスト
+    for m in _WISHES_RE.finditer(txt):
+        header, bullet = m.groups()
+        if header is not None:
+            header = header.strip()
             if " " in header:
                 traveler_name, section = header.split(None, 1)
             else:
                 traveler_name, section = header, "公開"
-            if traveler_name not in data:
-                data[traveler_name] = {"public": [], "private": []}
-            current = (traveler_name, section)
-            continue
-        if line.startswith("- ") and current:
-            traveler_name, section = current
-            if section == "非公開":
-                data[traveler_name].setdefault("private", []).append(line[2:])
-            else:
-                data[traveler_name].setdefault("public", []).append(line[2:])
-    # ensure keys
-    for k, v in list(data.items()):
-        data[k] = {"public": v.get("public", []) or [], "private": v.get("private", []) or []}
-    return data
-
-def build_agent_system(name_ja: str, public_bullets: List[str], private_bullets: List[str]) -> str:
+            entry = data.setdefault(traveler_name, {"public": [], "private": []})
+            bucket = entry["private" if section == "非公開" else "public"]
+        elif bucket is not None:
+            bucket.append(bullet)
+    return {k: {"public": tuple(v["public"]), "private": tuple(v["private"])} for k, v in data.items()}
+
+@functools.lru_cache(maxsize=256)
+def build_agent_system(name_ja: str, public_bullets: Tuple[str, ...], private_bullets: Tuple[str, ...]) -> str:
     """メインスクリプトと同様の方針で、公開/非公開の希望を含む役割プロンプトを生成。"""
-    pub = "".join(f"・{b}" for b in (public_bullets or []))
-    prv = "".join(f"・{b}" for b in (private_bullets or []))
+    pub = "・" + "・".join(public_bullets) if public_bullets else ""
+    prv = "・" + "・".join(private_bullets) if private_bullets else ""
     return (
         f"あなたは交渉参加者の{name_ja}です。\n"
         "【目的】合意を目指し、自然言語の対話のみで形成する。\n"
@@ -133,32 +117,195 @@ def build_agent_system(name_ja: str, public_bullets: List[str], private_bullets:
         "- 自分の非公開希望を守るため、具体的内容は明かさずに表現する。\n"
     )
 
+# 賛成キーワード（いずれかを含めば同意表明とみなす）。1回の走査で全語を探すため交互の正規表現にまとめる
+AGREE_KEYWORDS: Tuple[str, ...] = (
+    "賛成", "同意", "了承", "この案でいい", "この案で良い", "問題ない", "異論ありません",
+)
+_AGREE_RE = re.compile("|".join(map(re.escape, AGREE_KEYWORDS)))
+# 司会の合意確定宣言（先頭の空白は読み飛ばす。lstrip でコピーを作らずに判定する）
+_CONSENSUS_HEAD_RE = re.compile(r"\s*【合意確定】")
+
+def is_consensus_declaration(text: str) -> bool:
+    """先頭行が『【合意確定】』で、同じ発話に『【最終合意プラン】』を含むか（司会の発話に対して使う）。"""
+    return _CONSENSUS_HEAD_RE.match(text) is not None and "【最終合意プラン】" in text
+
+class ConsensusTermination(TerminationCondition):
+    """司会の合意確定宣言で trial を終える。TextMentionTermination("【合意確定】\n") は
+    改行なしの宣言を拾えないため、合意判定と同じ形式チェックでもチームを止める。"""
+
+    def __init__(self) -> None:
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for m in messages:
+            if type(m) is TextMessage and m.source == "moderator" and is_consensus_declaration(m.content):
+                self._terminated = True
+                return StopMessage(content="Consensus declared by moderator", source="ConsensusTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
+
+# 司会の system message（{names}: 参加者名の列挙、{n}: 人数）。セッション生成時に1回だけ埋める
+MODERATOR_SYSTEM_TEMPLATE = (
+    "あなたは旅行計画会議の司会者です。参加者は {names} の計{n}名です。\n"
+    "【役割】\n"
+    "- 各旅行者の意見を公平に引き出し、自然言語のみで合意形成を進める。\n"
+    "【ルール】\n"
+    "- 発言は自動的に 司会→各旅行者(順番)→司会→… の順で進む。\n"
+    "- 旅行者A〜Dの発言をあなたが作ってはいけない。\n"
+    "- 交渉では表・図・PDF・CSV・数値資料などの外部ファイルは使用しない。\n"
+    "- 本会議は『口頭合意の形成』のみを扱い、外部作業（予約・問い合わせ・見積・資料収集）、"
+    "  役割分担、提出期限・締切の提示を一切行わない。\n"
+    "【合意の扱い】\n"
+    "- 各旅行者が明確に『賛成』『同意』『了承』などの語で最終案への同意を表明した場合のみ、"
+    "  そのタイミングであなたはテキスト中に必ず『【合意確定】』という語を含めること。\n"
+    "- 合意が確定したときのあなたの最終発話には、以下を必ず含めること：\n"
+    "  1) メッセージの最初の行に『【合意確定】』という語だけ書き、\n"
+    "  2) 続けて、『【最終合意プラン】』から始まる、合意した1泊2日の旅行プラン全文の要約\n"
+    "     （行き先・各日の大まかな行程・宿泊・食事などを日本語で整理する）\n"
+    "- 『【最終合意プラン】』は1つのメッセージの中に書き、別メッセージには分割しない。\n"
+    "【論点】\n"
+    "- 行き先\n"
+    "- 交通手段\n"
+    "- 出発時間\n"
+    "- 宿泊施設タイプ\n"
+    "- したいこと"
+    "- その他\n"
+    "※出発地は全員共通で東京とする。\n"
+    "※日程は1泊2日として固定されているものとし、日付については議論しない。\n"
+    "※予算については議論しない。\n"
+    "【注意】\n"
+    "【ルール】や【合意の扱い】を復唱したり、参加者に説明したりしないこと。\n"
+)
+
+# ==== run_stream のイベント → (who, content) ====
+# イベントの型ごとに一度だけ属性を調べて取り出し関数を作り、以降は type(ev) で引くだけにする
+EventExtractor = Callable[[Any], Optional[Message]]
+_EXTRACTORS: Dict[type, EventExtractor] = {}
+
+def _no_message(ev: Any) -> Optional[Message]:
+    return None
+
+def _install_extractor(cls: type) -> EventExtractor:
+    fields = set(getattr(cls, "model_fields", ()))  # autogen のメッセージ/イベントは pydantic モデル
+    fields.update(k for k in ("source", "name", "content") if hasattr(cls, k))
+    if "content" not in fields:
+        extractor = _no_message  # TaskResult など、表示する本文を持たないもの
+    elif "source" in fields or "name" in fields:
+        getter = operator.attrgetter("source" if "source" in fields else "name", "content")
+
+        def extractor(ev: Any) -> Optional[Message]:
+            who, content = getter(ev)
+            return (who or "system", content) if content else None
+    else:
+        def extractor(ev: Any) -> Optional[Message]:
+            return ("system", ev.content) if ev.content else None
+    _EXTRACTORS[cls] = extractor
+    return extractor
+
+def event_message(ev: Any) -> Optional[Message]:
+    cls = type(ev)
+    return (_EXTRACTORS.get(cls) or _install_extractor(cls))(ev)
+
+# ==== モデルクライアント（プロセス内でモデルごとに1つ共有し、接続プールを使い回す） ====
+_MODEL_CLIENTS: Dict[str, OpenAIChatCompletionClient] = {}
+
+def get_model_client(model: str) -> OpenAIChatCompletionClient:
+    mc = _MODEL_CLIENTS.get(model)
+    if mc is None:
+        mc = _MODEL_CLIENTS[model] = OpenAIChatCompletionClient(model=model)
+    return mc
+
+async def close_model_clients() -> None:
+    clients = list(_MODEL_CLIENTS.values())
+    _MODEL_CLIENTS.clear()
+    # 1つが失敗しても残りは閉じる
+    await asyncio.gather(*(mc.close() for mc in clients), return_exceptions=True)
+
+JST = timezone(timedelta(hours=9), "JST")
+
 def jst_now_iso() -> str:
-    jst = timezone(timedelta(hours=9))
-    return datetime.now(jst).strftime("%Y-%m-%d %H:%M:%S %Z")
+    return datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S JST")
 
 # ==== 人間入力キュー ====
 class HumanIO:
+    """人間の旅行者の入力受け渡し。待ち手は1人なので Queue ではなく Future を直接渡す。"""
+    __slots__ = ("_roles", "_pending", "_buffered", "_closed")
+
     def __init__(self, travelers: Optional[List[str]] = None):
-        names = travelers or list(TRAVELER_ROLES)
-        self.queues: Dict[str, asyncio.Queue[str]] = {
-            name: asyncio.Queue() for name in names
-        }
+        self._roles = frozenset(travelers or TRAVELER_ROLES)
+        self._pending: Dict[str, asyncio.Future[str]] = {}  # 入力待ち中の Future
+        self._buffered: Dict[str, deque[str]] = {}  # 待ちが始まる前に届いた入力
+        self._closed = False
 
-    async def wait_input(self, who: str, prompt: str = "") -> str:
-        if who not in self.queues:
+    def _check(self, who: str) -> None:
+        if who not in self._roles:
             raise ValueError(f"unknown traveler: {who}")
-        q = self.queues[who]
-        text = await q.get()
-        return text
+
+    async def wait_input(self, who: str, prompt: str = "") -> str:
+        self._check(who)
+        buffered = self._buffered.get(who)
+        if buffered:
+            return buffered.popleft()
+        if self._closed:
+            raise RuntimeError("session stopped")
+        fut: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+        self._pending[who] = fut
+        try:
+            return await fut
+        finally:
+            self._pending.pop(who, None)
 
     def feed(self, who: str, text: str) -> None:
-        if who not in self.queues:
-            raise ValueError(f"unknown traveler: {who}")
-        self.queues[who].put_nowait(text)
+        self._check(who)
+        fut = self._pending.pop(who, None)
+        if fut is not None and not fut.done():
+            fut.set_result(text)
+        else:
+            self._buffered.setdefault(who, deque()).append(text)
+
+    def close(self) -> None:
+        """入力待ちを失敗させて打ち切る。UserProxyAgent が待ったままだとチームの実行が終わらないため。"""
+        self._closed = True
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(RuntimeError("session stopped"))
+        self._pending.clear()
+
+async def _human_input(hio: HumanIO, who: str, *_args: Any, **_kwargs: Any) -> str:
+    """UserProxyAgent の input_func。(prompt, cancellation_token) は使わず人間の入力を待つ。"""
+    return await hio.wait_input(who)
+
+def _log_run_failure(task: asyncio.Task) -> None:
+    """_run_task の例外（TaskGroup 由来の ExceptionGroup）を取り出してログに残す。"""
+    if not task.cancelled() and (exc := task.exception()) is not None:
+        logger.error("session task %s failed", task.get_name(), exc_info=exc)
+
+# ==== SSE リスナー ====
+class Listener:
+    """SSE 接続1本分の読み位置（Session の共有バッファにおける通し番号）。"""
+    __slots__ = ("cursor",)
+
+    def __init__(self, cursor: int):
+        self.cursor = cursor
 
 # ==== セッション ====
 class Session:
+    # セッションは会話ごとに作り捨てるので __dict__ を持たせない（属性を増やすときはここにも足す）
+    __slots__ = (
+        "wishes_md", "_wishes", "model_mod_name", "model_agent_name",
+        "travelers", "ai_travelers", "_config", "_moderator_system", "_system_prompts", "hio", "_input_funcs",
+        "_msg_who", "_msg_content", "_history_buf", "_log_buf", "listeners", "_live", "_live_seq", "_wake",
+        "_team", "_task", "_stop", "typing_q", "_run_task",
+    )
+
     def __init__(
         self,
         wishes_md: Optional[str] = None,
@@ -166,50 +313,142 @@ class Session:
         model_agent="gpt-5-mini",
         ai_travelers: Optional[List[str]] = None,
     ):
-        self.wishes_md = wishes_md or DEFAULT_WISHES_TEXT
+        self.wishes_md = wishes_md or default_wishes()
         # 旅行者ごとの公開/非公開希望をパースして保持
         self._wishes: WishesDict = parse_wishes_text(self.wishes_md)
         self.model_mod_name = model_mod
         self.model_agent_name = model_agent
         self.travelers: List[str] = list(TRAVELER_ROLES)
-        initial_ai = set(ai_travelers or [])  # None → [] にするだけ
-        self.ai_travelers = {t for t in initial_ai if t in self.travelers}
-
-        self.ai_travelers: set[str] = set(
-            traveler for traveler in initial_ai if traveler in self.travelers
+        # AI/人間の割り当てはセッション中に変わらない（get_config もここで1回だけ作る）
+        self.ai_travelers: frozenset[str] = TRAVELER_ROLE_SET.intersection(ai_travelers or ())
+        self._config: Dict[str, List[str]] = {
+            "ai_travelers": sorted(self.ai_travelers),
+            "human_travelers": sorted(t for t in self.travelers if t not in self.ai_travelers),
+        }
+        self._moderator_system = MODERATOR_SYSTEM_TEMPLATE.format(
+            names="、".join(TRAVELER_LABELS.get(t, t) for t in self.travelers),
+            n=len(self.travelers),
         )
+        # AI 旅行者の役割プロンプトは希望が決まった時点で確定するので、ここで1回だけ作る
+        self._system_prompts: Dict[str, str] = {
+            t: self._system_message_for_with_wishes(t) for t in self.ai_travelers
+        }
         self.hio = HumanIO(self.travelers)
         self._input_funcs = {
-            traveler: self._make_input_func(traveler) for traveler in self.travelers
+            traveler: functools.partial(_human_input, self.hio, traveler) for traveler in self.travelers
         }
-        self.messages: list[tuple[str, str]] = []
-        self.listeners: set[asyncio.Queue] = set()
+        # 発言者と本文は別々のリストで持つ（1件ごとのタプルを作らない）
+        self._msg_who: list[str] = []
+        self._msg_content: list[str] = []
+        self._history_buf = bytearray()  # messages の SSE フレームを連結したもの（再接続時はこれを1回で送る）
+        self._log_buf = bytearray()  # messages の Markdown 行を連結したもの（/session/log 用）
+        # 配信フレームは全リスナーで1本の deque を共有し、各リスナーは Listener.cursor で読み進める
+        self.listeners: list[Listener] = []
+        self._live: deque[bytes] = deque(maxlen=LIVE_BUFFER_MAX)
+        self._live_seq = 0  # これまでに _live へ積んだフレームの総数
+        self._wake = asyncio.Event()
         self._team = None
         self._task: Optional[asyncio.Task] = None
         self._stop = asyncio.Event()
         self.typing_q: asyncio.Queue[dict] = asyncio.Queue()
         self._run_task: asyncio.Task | None = None
 
-    def add_listener(self) -> asyncio.Queue:
-        q: asyncio.Queue = asyncio.Queue()
-        self.listeners.add(q)
-        return q
-
-    def remove_listener(self, q: asyncio.Queue) -> None:
-        self.listeners.discard(q)
+    def add_listener(self) -> Listener:
+        listener = Listener(self._live_seq)
+        self.listeners.append(listener)
+        return listener
+
+    def remove_listener(self, listener: Listener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    async def listen(self, listener: Listener) -> AsyncIterator[bytes]:
+        """listener の読み位置から、溜まっている配信フレームを最大 SSE_BATCH_MAX 件ずつ連結して返す。
+        取りこぼしがあれば先頭に __lagged__ を付ける。"""
+        while True:
+            if listener.cursor == self._live_seq:
+                await self._wake.wait()
+                continue
+            base = self._live_seq - len(self._live)
+            chunk: List[bytes] = []
+            if listener.cursor < base:
+                # クライアントは再接続すれば履歴（history_frames）から再同期できる
+                chunk.append(sse_frame({"type": "__lagged__", "dropped": base - listener.cursor}))
+                listener.cursor = base
+            start = listener.cursor - base
+            stop = min(len(self._live), start + SSE_BATCH_MAX)
+            chunk.extend(itertools.islice(self._live, start, stop))
+            listener.cursor = base + stop
+            yield b"".join(chunk)
 
     def broadcast(self, ev: dict) -> None:
-        for q in list(self.listeners):
-            try:
-                q.put_nowait(ev)
-            except Exception:
-                pass
+        # 聞き手がいなければ整形もしない（ログに残す発言は _record が履歴バッファに積む）
+        if self.listeners:
+            self._fanout(sse_frame(ev))
+
+    @property
+    def messages(self) -> list[tuple[str, str]]:
+        return list(zip(self._msg_who, self._msg_content))
+
+    def history_frames(self) -> bytes:
+        return bytes(self._history_buf)
+
+    def _record(self, who: str, content: str) -> None:
+        """ログに残すメッセージ。フレームは履歴バッファと配信で共有する。"""
+        frame = sse_frame({"type": "message", "who": who, "content": content})
+        self._msg_who.append(who)
+        self._msg_content.append(content)
+        self._history_buf += frame
+        self._log_buf += f"- **[{who}]** {content}\n".encode()
+        self._fanout(frame)
+
+    def _fanout(self, frame: bytes) -> None:
+        self._live.append(frame)
+        self._live_seq += 1
+        # 待っているリスナーを1回の set でまとめて起こし、次の待ち合わせ用に Event を差し替える
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    def start(self, name: Optional[str] = None) -> None:
+        self._run_task = asyncio.create_task(self._run(), name=name)
+        self._run_task.add_done_callback(_log_run_failure)
 
-    def _make_input_func(self, who: str):
-        async def _input(*_args, **_kwargs) -> str:
-            return await self.hio.wait_input(who)
+    @property
+    def finished(self) -> bool:
+        """交渉タスクが終わっている（正常終了・エラー・停止のいずれも）。"""
+        return self._run_task is not None and self._run_task.done()
+
+    async def _run(self) -> None:
+        """交渉と心拍を1つの TaskGroup で動かす。_run_task を止めれば両方まとめて止まる。
+        どう終わっても接続中のリスナーには __END__ を送る（以降に繋いだ接続は stream 側で履歴 + __END__ を返す）。"""
+        try:
+            async with asyncio.TaskGroup() as tg:
+                ping = tg.create_task(self._ping_loop())
+                try:
+                    await self.stream_run()
+                finally:
+                    ping.cancel()
+        finally:
+            self.broadcast({"type": "__END__"})
+
+    async def stop(self) -> None:
+        """実行中の交渉を止め、接続中のリスナーを __END__ で帰す。"""
+        task = self._run_task
+        if task and not task.done():
+            # キャンセルは run_stream の finally でランタイムが空くのを待つので、人間の入力待ちも先に打ち切る
+            task.cancel()
+            self.hio.close()
+            await asyncio.wait((task,), timeout=STOP_TIMEOUT_SEC)
+        if not self.finished:
+            # 未起動か、待ちきれなかった場合だけここで帰す（終わっていれば _run が送り済み）
+            self.broadcast({"type": "__END__"})
+        self.listeners.clear()
 
-        return _input
+    async def _ping_loop(self) -> None:
+        while True:
+            await asyncio.sleep(PING_INTERVAL_SEC)
+            if self.listeners:
+                self._fanout(SSE_PING)
 
     def _system_message_for(self, traveler: str) -> str:
         name = TRAVELER_LABELS.get(traveler, traveler)
@@ -222,24 +461,21 @@ class Session:
     def _system_message_for_with_wishes(self, traveler: str) -> str:
         """wishes があれば公開/非公開を含んだ詳細プロンプト、なければ従来の汎用を返す。"""
         name_ja = TRAVELER_LABELS.get(traveler, traveler)
-        w = self._wishes.get(name_ja) if hasattr(self, "_wishes") else None
+        w = self._wishes.get(name_ja)
         if w and (w.get("public") or w.get("private")):
-            return build_agent_system(name_ja, w.get("public", []) or [], w.get("private", []) or [])
+            return build_agent_system(name_ja, w.get("public", ()), w.get("private", ()))
         return self._system_message_for(traveler)
 
     @property
     def human_travelers(self) -> List[str]:
-        return [t for t in self.travelers if t not in self.ai_travelers]
+        # travelers は役割順（= ソート順）なので、__init__ で作った get_config の一覧をそのまま返す
+        return self._config["human_travelers"]
 
     def is_ai_traveler(self, who: str) -> bool:
         return who in self.ai_travelers
 
     def get_config(self) -> Dict[str, List[str]]:
-        humans = sorted(t for t in self.travelers if t not in self.ai_travelers)
-        return {
-            "ai_travelers": sorted(self.ai_travelers),
-            "human_travelers": humans,
-        }
+        return self._config
 
     def set_typing(self, who: str, active: bool) -> None:
         self.typing_q.put_nowait({"type": "typing", "who": who, "active": bool(active)})
@@ -247,73 +483,12 @@ class Session:
     async def stream_run(self):  # -> AsyncIterator[tuple[str, str]]
         self.broadcast({"type": "message", "who": "system", "content": "session started"})
 
-        # モデルクライアント（trial 間で再利用）
-        moderator_mc = OpenAIChatCompletionClient(model=self.model_mod_name)
-        agent_mc = OpenAIChatCompletionClient(model=self.model_agent_name)
-
-        # 旅行者ソース名と賛成キーワード（main.py と同様の合意判定ロジック）
-        TRAVELER_SOURCES = set(self.travelers)
-        AGREE_KEYWORDS = [
-            "賛成", "同意", "了承", "この案でいい", "この案で良い", "問題ない", "異論ありません"
-        ]
-
-        # has_valid_consensus: main.py のロジックを Session 用に移植
-        def has_valid_consensus(raw_messages) -> bool:
-            """
-            TextMessage 群から「本物の合意確定メッセージ」があるか判定。
-            条件:
-            - source == 'moderator' のメッセージで、
-              先頭行が『【合意確定】』で始まり、かつ同じメッセージ内に『【最終合意プラン】』を含む
-            - そのメッセージより前に、全ての TRAVELER_SOURCES が賛成キーワードを含む発話をしている
-            """
-            agree_index: Optional[int] = None
-
-            for idx, m in enumerate(raw_messages):
-                if isinstance(m, TextMessage) and m.source == "moderator":
-                    text = m.content or ""
-                    stripped = text.lstrip()
-                    if stripped.startswith("【合意確定】") and "【最終合意プラン】" in stripped:
-                        agree_index = idx
-                        break
-
-            if agree_index is None:
-                return False
-
-            agreed: Dict[str, bool] = {src: False for src in TRAVELER_SOURCES}
-            for m in raw_messages[:agree_index]:
-                if isinstance(m, TextMessage) and m.source in agreed:
-                    text = m.content or ""
-                    if any(kw in text for kw in AGREE_KEYWORDS):
-                        agreed[m.source] = True
-
-            return all(agreed.values())
-
-        # イベントから値を安全に取り出すヘルパ
-        def pick(obj, *keys, default=None):
-            # dict形式
-            if isinstance(obj, dict):
-                for k in keys:
-                    if k in obj and obj[k]:
-                        return obj[k]
-                return default
-            # 属性形式
-            for k in keys:
-                try:
-                    v = getattr(obj, k)
-                    if v:
-                        return v
-                except Exception:
-                    pass
-            # dataサブ構造
-            try:
-                data = getattr(obj, "data", None)
-                if isinstance(data, dict):
-                    for k in keys:
-                        if k in data and data[k]:
-                            return data[k]
-            except Exception:
-                pass
-            return default
+        # モデルクライアント（セッション・trial 間で共有。閉じるのはサーバ終了時）
+        moderator_mc = get_model_client(self.model_mod_name)
+        agent_mc = get_model_client(self.model_agent_name)
+
+        # 旅行者ソース名（main.py と同様の合意判定ロジックを、ストリーム中に逐次判定する）
+        TRAVELER_SOURCES = frozenset(self.travelers)
 
         # trial 関連設定（main.py に合わせる）
         num_travelers = len(self.travelers)
@@ -321,8 +496,42 @@ class Session:
         MAX_RETRIES = 3  # 「やり直し3回まで」= 最大4試行
 
         try:
+            # 参加者・終了条件・チームは1回だけ作り、再試行では team.reset() で会話状態だけ戻す
+            # 司会
+            moderator = AssistantAgent(
+                name="moderator",
+                system_message=self._moderator_system,
+                model_client=moderator_mc,
+            )
+
+            participants = [moderator]
+            for traveler in self.travelers:
+                if traveler in self.ai_travelers:
+                    participants.append(
+                        AssistantAgent(
+                            name=traveler,
+                            system_message=self._system_prompts[traveler],
+                            model_client=agent_mc,
+                        )
+                    )
+                else:
+                    participants.append(
+                        UserProxyAgent(name=traveler, input_func=self._input_funcs[traveler])
+                    )
+
+            # 終了条件：TextMentionTermination + 合意確定宣言 + MaxMessageTermination
+            termination = (
+                TextMentionTermination("【合意確定】\n")
+                | ConsensusTermination()
+                | MaxMessageTermination(MAX_MESSAGES_PER_TRIAL)
+            )
+            team = RoundRobinGroupChat(participants, termination_condition=termination)
+            self._team = team
+
             # 再試行付き multi-run
             for trial in range(1, MAX_RETRIES + 2):  # 1..(MAX_RETRIES+1)
+                if trial > 1:
+                    await team.reset()
                 # trial 開始通知
                 self.broadcast({
                     "type": "message",
@@ -330,92 +539,31 @@ class Session:
                     "content": f"trial {trial} started",
                 })
 
-                # 司会 system message
-                traveler_names_ja = [TRAVELER_LABELS.get(t, t) for t in self.travelers]
-                traveler_list_str = "、".join(traveler_names_ja)
-                moderator_system_message = (
-                    f"あなたは旅行計画会議の司会者です。参加者は {traveler_list_str} の計{num_travelers}名です。\n"
-                    "【役割】\n"
-                    "- 各旅行者の意見を公平に引き出し、自然言語のみで合意形成を進める。\n"
-                    "【ルール】\n"
-                    "- 発言は自動的に 司会→各旅行者(順番)→司会→… の順で進む。\n"
-                    "- 旅行者A〜Dの発言をあなたが作ってはいけない。\n"
-                    "- 交渉では表・図・PDF・CSV・数値資料などの外部ファイルは使用しない。\n"
-                    "- 本会議は『口頭合意の形成』のみを扱い、外部作業（予約・問い合わせ・見積・資料収集）、"
-                    "  役割分担、提出期限・締切の提示を一切行わない。\n"
-                    "【合意の扱い】\n"
-                    "- 各旅行者が明確に『賛成』『同意』『了承』などの語で最終案への同意を表明した場合のみ、"
-                    "  そのタイミングであなたはテキスト中に必ず『【合意確定】』という語を含めること。\n"
-                    "- 合意が確定したときのあなたの最終発話には、以下を必ず含めること：\n"
-                    "  1) メッセージの最初の行に『【合意確定】』という語だけ書き、\n"
-                    "  2) 続けて、『【最終合意プラン】』から始まる、合意した1泊2日の旅行プラン全文の要約\n"
-                    "     （行き先・各日の大まかな行程・宿泊・食事などを日本語で整理する）\n"
-                    "- 『【最終合意プラン】』は1つのメッセージの中に書き、別メッセージには分割しない。\n"
-                    "【論点】\n"
-                    "- 行き先\n"
-                    "- 交通手段\n"
-                    "- 出発時間\n"
-                    "- 宿泊施設タイプ\n"
-                    "- したいこと"
-                    "- その他\n"
-                    "※出発地は全員共通で東京とする。\n"
-                    "※日程は1泊2日として固定されているものとし、日付については議論しない。\n"
-                    "※予算については議論しない。\n"
-                    "【注意】\n"
-                    "【ルール】や【合意の扱い】を復唱したり、参加者に説明したりしないこと。\n"
-                )
-
-                # 司会
-                moderator = AssistantAgent(
-                    name="moderator",
-                    system_message=moderator_system_message,
-                    model_client=moderator_mc,
-                )
-
-                participants = [moderator]
-                for traveler in self.travelers:
-                    if traveler in self.ai_travelers:
-                        participants.append(
-                            AssistantAgent(
-                                name=traveler,
-                                system_message=self._system_message_for_with_wishes(traveler),
-                                model_client=agent_mc,
-                            )
-                        )
-                    else:
-                        participants.append(
-                            UserProxyAgent(name=traveler, input_func=self._input_funcs[traveler])
-                        )
-
-                # 終了条件：TextMentionTermination + MaxMessageTermination
-                termination = (
-                    TextMentionTermination("【合意確定】\n")
-                    | MaxMessageTermination(MAX_MESSAGES_PER_TRIAL)
-                )
-                team = RoundRobinGroupChat(participants, termination_condition=termination)
-                self._team = team
-
                 task = (
                     "あなたたちは4人の旅行者と司会です。1泊2日の国内旅行計画を合意してください。"
                     "出発地は全員共通で東京とし、予算と日付については議論しないものとします。"
                     "話し合いを開始してください。"
                 )
 
-                raw_messages: List[TextMessage] = []
+                # 合意判定の状態。本物の合意確定 =
+                # 司会の発話で先頭行が『【合意確定】』、同じ発話内に『【最終合意プラン】』を含み、
+                # それより前に全旅行者が賛成キーワードを含む発話をしていること（最初の合意確定発話だけで判定）
+                agreed: set[str] = set()
+                valid: Optional[bool] = None
+                record = self._record
 
-                # ストリーム実行
+                # ストリーム実行（ループ内の属性参照はローカルに束縛済み）
                 async for ev in team.run_stream(task=task):
-                    if isinstance(ev, TextMessage):
-                        raw_messages.append(ev)
-
-                    who = pick(ev, "source", "name", default="system")
-                    content = pick(ev, "content", default=None)
-                    if content:
-                        self.messages.append((who, content))
-                        self.broadcast({"type": "message", "who": who, "content": content})
-
-                # この trial の合意妥当性をチェック
-                valid = has_valid_consensus(raw_messages)
+                    if got := event_message(ev):
+                        # 本文のあるイベントだけ、取り出し済みの (who, text) で判定する（型は同一性で比較）
+                        if valid is None and type(ev) is TextMessage:
+                            who, text = got
+                            if who == "moderator":
+                                if is_consensus_declaration(text):
+                                    valid = agreed >= TRAVELER_SOURCES
+                            elif who in TRAVELER_SOURCES and _AGREE_RE.search(text):
+                                agreed.add(who)
+                        record(*got)
 
                 if valid:
                     # 有効な合意が得られたので終了
@@ -425,29 +573,17 @@ class Session:
                 if trial < MAX_RETRIES + 1:
                     msg = "問題が発生したため再試行します"
                     print(msg)
-                    self.messages.append(("system", msg))
-                    self.broadcast({"type": "message", "who": "system", "content": msg})
+                    self._record("system", msg)
                     # ループして最初から会話をやり直す
                     continue
                 else:
                     # 再試行上限に達した場合は、そのまま終了
                     break
-
-            # 全 trial 終了
-            self.broadcast({"type": "__END__"})
         except Exception as e:
             self.broadcast({"type": "message", "who": "system", "content": f"error: {e!r}"})
             raise
-        finally:
-            await agent_mc.close()
-            await moderator_mc.close()
-
-    def get_log_markdown(self) -> str:
-        lines = [
-            "# 交渉ログ",
-            f"- 実行: {jst_now_iso()}",
-            "## メッセージ",
-        ]
-        for who, c in self.messages:
-            lines.append(f"- **[{who}]** {c}")
-        return "\n".join(lines)
+
+    def iter_log_lines(self) -> Iterator[bytes]:
+        """交渉ログ（Markdown）を bytes で返す。メッセージ行は _record で整形済みのものをそのまま送る。"""
+        yield f"# 交渉ログ\n- 実行: {jst_now_iso()}\n## メッセージ\n".encode()
+        yield bytes(self._log_buf)